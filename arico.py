@@ -1,8 +1,29 @@
 import argparse
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import contextlib
 import copy
+import hashlib
+import io
+import itertools
+import json
+import math
+import mmap
+import os
 import sys
+import tempfile
+import time
+import zlib
 from typing import List, BinaryIO
 
+# NumPy необязателен: с ним подсчёт статистики и упаковка таблицы частот выполняются векторно
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
 
 class AricoException(Exception):
 
@@ -10,6 +31,17 @@ class AricoException(Exception):
         super().__init__(msg)
         self.code = code
 
+    # Исключения передаются из дочерних процессов блочного режима. По умолчанию при распаковке вызывается cls(msg),
+    # что не подходит подклассам с другими аргументами, поэтому исключение восстанавливается по готовому сообщению и коду
+    def __reduce__(self):
+        return AricoException._restore, (type(self), str(self), self.code)
+
+    @staticmethod
+    def _restore(cls, msg: str, code: int):
+        exception = cls.__new__(cls)
+        AricoException.__init__(exception, msg, code)
+        return exception
+
 
 class InvalidSignatureException(AricoException):
 
@@ -28,23 +60,1160 @@ class InvalidCountsCheckpointByteException(AricoException):
     def __init__(self, found: int) -> None:
         super().__init__(f"Error: Invalid format counts_checkpoint not found, found byte = {found}", 12)
 
+
+class UnsupportedVersionException(AricoException):
+
+    def __init__(self, version: int) -> None:
+        super().__init__(f"Error: Unsupported format version {version}", 14)
+
+
+class UnsupportedModelException(AricoException):
+
+    def __init__(self, model) -> None:
+        super().__init__(f"Error: Unsupported model {model}", 15)
+
+
+class InvalidHeaderCheckpointByteException(AricoException):
+
+    def __init__(self, found: int) -> None:
+        super().__init__(f"Error: Invalid format header_checkpoint not found, found byte = {found}", 16)
+
+
+class InvalidWidthException(AricoException):
+
+    def __init__(self, width: int, minimum: int) -> None:
+        super().__init__(f"Error: Code word width {width} is too small for the chosen model, at least {minimum} is required", 17)
+
+
+class RangeNotSupportedException(AricoException):
+
+    def __init__(self) -> None:
+        super().__init__("Error: Range decoding requires a seekable block container (encode with --block_size)", 18)
+
+
+class UnsupportedEngineException(AricoException):
+
+    def __init__(self, engine) -> None:
+        super().__init__(f"Error: Unsupported engine {engine}", 19)
+
+
+class InvalidEngineWidthException(AricoException):
+
+    def __init__(self, engine: str, width: int, widths) -> None:
+        supported = ", ".join(str(w) for w in widths)
+        super().__init__(f"Error: Code word width {width} is not supported by the {engine} engine, use one of {supported}", 20)
+
+
+class InvalidLanesException(AricoException):
+
+    def __init__(self, lanes) -> None:
+        super().__init__(f"Error: Number of rans lanes {lanes} is not supported, use {RANS_LANES[0]} to {RANS_LANES[-1]}", 25)
+
+
+class InvalidStreamException(AricoException):
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(f"Error: Invalid stream, {reason}", 21)
+
+
+class EntryNotFoundException(AricoException):
+
+    def __init__(self, name: str) -> None:
+        super().__init__(f"Error: Entry {name} is not found in the archive", 22)
+
+
+class ChecksumMismatchException(AricoException):
+
+    def __init__(self) -> None:
+        super().__init__("Error: Checksum mismatch, decoded data is corrupted", 24)
+
+
+class DictionaryNotFoundException(AricoException):
+
+    def __init__(self, identifier: str) -> None:
+        super().__init__(f"Error: Trained model {identifier} is not loaded, pass its file with --dictionary", 23)
+
+
+# Версия расширенного формата заголовка. Заголовок старого формата версии не содержит
+# Версия 2 хранит таблицу частот статической модели из 256 значений одинаковой длины,
+# версия 3 - битовую карту встреченных символов и частоты только этих символов в формате varint,
+# версия 4 завершает поток контрольной суммой CRC32 исходных данных (4 байта старшим байтом вперёд)
+FORMAT_VERSION = 4
+SUPPORTED_VERSIONS = (2, 3, 4)  # Версии, которые умеет читать декодер
+CHECKSUM_VERSION = 4  # Первая версия с контрольной суммой
+
+# Версия формата файла обученной модели. Она не зависит от версии потока: модель читается отдельно от потоков
+DICTIONARY_VERSION = 1
+
+# Идентификаторы моделей, записываемые в расширенный заголовок
+# stored - данные без кодирования, которые записываются, когда сжатие не окупается
+MODELS = {
+    'static': 0,
+    'adaptive': 1,
+    'ppm': 2,
+    'stored': 3,
+    'dictionary': 4,  # Статическая модель, обученная заранее: в заголовке записывается только её идентификатор
+}
+
+# Идентификаторы кодеров, записываемые в расширенный заголовок
+ENGINES = {
+    'arithmetic': 0,
+    'range': 1,
+    'rans': 2,
+}
+
+# Ширины машинного слова, с которыми работает интервальный кодер
+RANGE_WIDTHS = (32, 64)
+
+# Допустимое количество чередующихся состояний rANS. Оно записывается в заголовок одним байтом
+RANS_LANES = range(1, 5)
+
+
+# Буферизованная запись бит в выходной поток
+# Биты накапливаются в аккумуляторе, целые байты - в bytearray, который сбрасывается в поток блоками по chunk_size
+class BitWriter:
+
+    def __init__(self, out: BinaryIO, chunk_size: int = 65536) -> None:
+        self._out = out
+        self._chunk_size = chunk_size
+
+        self._buffer = bytearray()
+        self._accumulator = 0  # Биты, ещё не собранные в целый байт
+        self._fill = 0  # Количество бит в аккумуляторе
+
+        self.bits_written = 0  # Количество записанных бит (без учёта выравнивания до байта)
+
+    # Запись набора байт в обход аккумулятора. Допустима только на границе байта
+    def write_bytes(self, data) -> None:
+        if self._fill != 0:
+            raise ValueError("BitWriter is not aligned to byte boundary")
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self._flush_buffer()
+
+    # Запись count младших бит value, начиная со старшего
+    def write_bits(self, value: int, count: int) -> None:
+        if count <= 0:
+            return
+
+        self.bits_written += count
+
+        accumulator = (self._accumulator << count) | value
+        fill = self._fill + count
+
+        # Если набралось хотя бы на один байт - переносим целые байты в буфер
+        if fill >= 8:
+            rest = fill & 7
+            self._buffer += (accumulator >> rest).to_bytes(fill >> 3, "big")
+            accumulator &= (1 << rest) - 1
+            fill = rest
+
+            if len(self._buffer) >= self._chunk_size:
+                self._flush_buffer()
+
+        self._accumulator = accumulator
+        self._fill = fill
+
+    def write_bit(self, bit: int) -> None:
+        self.write_bits(bit, 1)
+
+    # Запись count одинаковых бит
+    def write_repeated(self, bit: int, count: int) -> None:
+        if bit:
+            self.write_bits((1 << count) - 1, count)
+        else:
+            self.write_bits(0, count)
+
+    def _flush_buffer(self) -> None:
+        if self._buffer:
+            self._out.write(self._buffer)
+            self._buffer = bytearray()
+
+    # Дополнение последнего байта нулями и сброс буфера в выходной поток
+    def flush(self) -> None:
+        if self._fill != 0:
+            self._buffer.append(self._accumulator << (8 - self._fill))
+            self._accumulator = 0
+            self._fill = 0
+        self._flush_buffer()
+
+
+# Чтение бит из входного потока без копирования
+# Поток считывается блоками по chunk_size, текущая позиция задаётся индексом байта и смещением бита в memoryview блока
+class BitReader:
+
+    def __init__(self, file: BinaryIO, chunk_size: int = 65536) -> None:
+        self._file = file
+        self._chunk_size = chunk_size
+
+        self._view = memoryview(b"")
+        self._index = 0  # Индекс текущего байта в блоке
+        self._offset = 0  # Количество уже прочитанных бит текущего байта
+        self._consumed = 0  # Количество байт в уже прочитанных блоках
+
+        self.exhausted = False  # Флаг того, что при чтении был достигнут конец потока
+
+    # Количество прочитанных бит. Считается по позиции в потоке, поэтому чтение не замедляет
+    @property
+    def bits_read(self) -> int:
+        return (self._consumed + self._index) * 8 + self._offset
+
+    # Считывание следующего блока. Возвращает False, если поток закончился
+    def _next_chunk(self) -> bool:
+        chunk = self._file.read(self._chunk_size)
+        if not chunk:
+            self.exhausted = True
+            return False
+
+        self._consumed += len(self._view)
+        self._view = memoryview(chunk)
+        self._index = 0
+        self._offset = 0
+        return True
+
+    def read_bit(self) -> int:
+        if self._index >= len(self._view) and not self._next_chunk():
+            return 0
+
+        bit = (self._view[self._index] >> (7 - self._offset)) & 1
+        self._offset += 1
+        if self._offset == 8:
+            self._offset = 0
+            self._index += 1
+        return bit
+
+    # Чтение целого байта. На границе байта он берётся из блока напрямую
+    def read_byte(self) -> int:
+        if self._offset == 0 and self._index < len(self._view):
+            byte = self._view[self._index]
+            self._index += 1
+            return byte
+        return self.read_bits(8)
+
+    # Чтение count байт, записанных после закодированных данных (например, контрольной суммы), с ближайшей границы байта
+    def read_aligned_bytes(self, count: int) -> bytes:
+        if self._offset:
+            self._offset = 0
+            self._index += 1
+
+        data = bytes(self._view[self._index:self._index + count])
+        self._index += len(data)
+        if len(data) < count:
+            data += self._file.read(count - len(data))
+        return data
+
+    # Чтение count бит за один вызов, начиная со старшего
+    # Если поток закончился раньше - недостающие биты считаются нулями, а флаг exhausted устанавливается
+    def read_bits(self, count: int) -> int:
+        value = 0
+
+        while count > 0:
+            available = (len(self._view) - self._index) * 8 - self._offset
+            if available <= 0:
+                if not self._next_chunk():
+                    return value << count
+                continue
+
+            taken = min(count, available)
+            end_bit = self._offset + taken
+            end_byte = self._index + ((end_bit + 7) >> 3)
+
+            # Срез memoryview не копирует данные блока
+            word = int.from_bytes(self._view[self._index:end_byte], "big")
+            word >>= (end_byte - self._index) * 8 - end_bit
+            value = (value << taken) | (word & ((1 << taken) - 1))
+
+            self._index += end_bit >> 3
+            self._offset = end_bit & 7
+            count -= taken
+
+        return value
+
+
+# Поток вывода, считающий CRC32 всех записанных в него данных. Через него декодер проверяет контрольную сумму потока
+class ChecksumWriter:
+
+    def __init__(self, out) -> None:
+        self._out = out
+        self.crc = 0
+
+    def write(self, data) -> int:
+        self.crc = zlib.crc32(data, self.crc)
+        return self._out.write(data)
+
+
+# Приёмник, отбрасывающий данные: проверка архива декодированием без записи на диск
+class NullWriter:
+
+    @staticmethod
+    def write(data) -> int:
+        return len(data)
+
+
+# Входной файл, отображённый в память. Повторяет интерфейс чтения файла, но read возвращает срезы memoryview
+# без выделения новых объектов bytes, поэтому оба прохода кодирования и BitReader работают прямо с отображением
+class MappedInput:
+
+    def __init__(self, file: BinaryIO) -> None:
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._position = file.tell()
+
+    # Отображение файла, если это возможно. Пустые файлы, каналы и объекты в памяти возвращаются как есть
+    @classmethod
+    def open(cls, file: BinaryIO):
+        try:
+            return cls(file)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            return file
+
+    def read(self, size: int = -1) -> memoryview:
+        start = min(self._position, len(self._view))
+        end = len(self._view) if size is None or size < 0 else min(start + size, len(self._view))
+        self._position = end
+        return self._view[start:end]
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    @staticmethod
+    def seekable() -> bool:
+        return True
+
+    # Освобождение отображения. Пока вызывающий удерживает срезы, возвращённые read, отображение закрыть нельзя:
+    # тогда оно освобождается вместе с последним срезом
+    def close(self) -> None:
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+# Арифметический кодер с обработкой исчезновения порядка, работающий с произвольной моделью
+# Модель передаёт ему границы интервала символа и общую частоту, которая не должна превышать четверти диапазона
+class ArithmeticEncoder:
+
+    def __init__(self, writer: BitWriter, width: int) -> None:
+        self._writer = writer
+        self._width = width
+
+        self._mask = (1 << width) - 1
+        self._half = 1 << (width - 1)
+        self._quarter = self._half >> 1
+
+        self._low = 0
+        self._high = self._mask
+        self._power_loss = 0  # Количество отложенных бит исчезновения порядка
+
+        self.underflows = 0  # Количество исчезновений порядка, учитывается при выводе отложенных бит
+
+    def encode(self, low: int, high: int, total: int) -> None:
+        width, mask, quarter = self._width, self._mask, self._quarter
+
+        rng = self._high - self._low + 1
+        code_high = self._low + rng * high // total - 1
+        code_low = self._low + rng * low // total
+
+        while True:
+            shared = width - (code_low ^ code_high).bit_length()
+
+            if shared > 0:
+                # Первый совпавший бит, за ним отложенные инвертированные биты и остальные совпавшие биты
+                if self._power_loss != 0:
+                    elder = code_low >> (width - 1)
+                    self._writer.write_bit(elder)
+                    self._writer.write_repeated(elder ^ 1, self._power_loss)
+                    self._writer.write_bits((code_low >> (width - shared)) & ((1 << (shared - 1)) - 1), shared - 1)
+                    self.underflows += self._power_loss
+                    self._power_loss = 0
+                else:
+                    self._writer.write_bits(code_low >> (width - shared), shared)
+
+                code_low = (code_low << shared) & mask
+                code_high = ((code_high << shared) | ((1 << shared) - 1)) & mask
+            # Границы сошлись к середине диапазона - исчезновение порядка: удаляем второй разряд и откладываем бит.
+            # Все исчезновения подряд обрабатываются за один шаг, а считаются они по отложенным битам при их выводе
+            elif code_low >= quarter and code_high < self._half + quarter:
+                # Длина серии: сколько разрядов после старшего у нижней границы равны 1, а у верхней - 0
+                run = width - 1 - ((self._half - 1 - code_low) | (code_high - self._half)).bit_length()
+                code_low = ((code_low - self._half) << run) + self._half
+                code_high = ((code_high - self._half) << run) + self._half | ((1 << run) - 1)
+                self._power_loss += run
+            else:
+                break
+
+        self._low, self._high = code_low, code_high
+
+    # Завершение кодирования: в поток выталкивается нижняя граница целиком,
+    # поэтому декодер прочитает ровно столько бит, сколько записал кодер
+    def finish(self) -> None:
+        elder = self._low >> (self._width - 1)
+        self._writer.write_bit(elder)
+        self._writer.write_repeated(elder ^ 1, self._power_loss)
+        self._writer.write_bits(self._low & (self._half - 1), self._width - 1)
+        self.underflows += self._power_loss
+        self._power_loss = 0
+
+
+# Арифметический декодер, парный ArithmeticEncoder
+class ArithmeticDecoder:
+
+    def __init__(self, reader: BitReader, width: int) -> None:
+        self._reader = reader
+        self._width = width
+
+        self._mask = (1 << width) - 1
+        self._half = 1 << (width - 1)
+        self._quarter = self._half >> 1
+
+        self._low = 0
+        self._high = self._mask
+        self._code = reader.read_bits(width)
+
+        self.underflows = 0
+
+    # Значение накопленной частоты, попадающее в интервал закодированного символа
+    def target(self, total: int) -> int:
+        return ((self._code - self._low + 1) * total - 1) // (self._high - self._low + 1)
+
+    def decode(self, low: int, high: int, total: int) -> None:
+        width, mask, quarter = self._width, self._mask, self._quarter
+        reader = self._reader
+
+        rng = self._high - self._low + 1
+        code_high = self._low + rng * high // total - 1
+        code_low = self._low + rng * low // total
+        code = self._code
+
+        while True:
+            shared = width - (code_low ^ code_high).bit_length()
+
+            if shared > 0:
+                code_low = (code_low << shared) & mask
+                code_high = ((code_high << shared) | ((1 << shared) - 1)) & mask
+                code = ((code << shared) | reader.read_bits(shared)) & mask
+            elif code_low >= quarter and code_high < self._half + quarter:
+                # Длина серии: сколько разрядов после старшего у нижней границы равны 1, а у верхней - 0
+                run = width - 1 - ((self._half - 1 - code_low) | (code_high - self._half)).bit_length()
+                code_low = ((code_low - self._half) << run) + self._half
+                code_high = ((code_high - self._half) << run) + self._half | ((1 << run) - 1)
+                code = ((code - self._half) << run) + self._half | reader.read_bits(run)
+                self.underflows += run  # Один раз на серию, а не на каждое исчезновение
+            else:
+                break
+
+        self._low, self._high, self._code = code_low, code_high, code
+
+
+# Интервальный кодер (range coder Субботина) на машинном слове в 32 или 64 бита
+# Нормализация выполняется целыми байтами, а перенос исключается подрезанием интервала, поэтому стоимость символа
+# не зависит от ширины. Сумма частот модели не должна превышать BOT = 2 ** (width - 16)
+class RangeEncoder:
+
+    def __init__(self, writer: BitWriter, width: int) -> None:
+        self._writer = writer
+        self._width = width
+
+        self._mask = (1 << width) - 1
+        self._shift = width - 8
+        self._top = 1 << (width - 8)
+        self._bot = 1 << (width - 16)
+
+        self._low = 0
+        self._range = self._mask
+        self._buffer = bytearray()
+
+        self.truncations = 0  # Количество подрезаний интервала на границе старшего байта
+
+    def encode(self, low: int, high: int, total: int) -> None:
+        r = self._range // total
+        code_low = self._low + r * low
+        rng = r * (high - low)
+
+        top, bot, mask, shift = self._top, self._bot, self._mask, self._shift
+        while True:
+            if (code_low ^ (code_low + rng)) >= top:
+                if rng >= bot:
+                    break
+                # Интервал мал, но пересекает границу старшего байта - подрезаем его, чтобы не было переноса
+                rng = -code_low & (bot - 1)
+                self.truncations += 1
+            self._buffer.append(code_low >> shift)
+            code_low = (code_low << 8) & mask
+            rng = (rng << 8) & mask
+
+        self._low, self._range = code_low, rng
+
+        if len(self._buffer) >= 4096:
+            self._flush_buffer()
+
+    def _flush_buffer(self) -> None:
+        # Запись идёт на границе байта, поэтому байты передаются записывающему напрямую
+        self._writer.write_bytes(self._buffer)
+        self._writer.bits_written += 8 * len(self._buffer)
+        self._buffer = bytearray()
+
+    # Завершение кодирования: нижняя граница записывается целиком, декодер прочитает ровно столько же байт
+    def finish(self) -> None:
+        self._buffer += self._low.to_bytes(self._width // 8, "big")
+        self._flush_buffer()
+
+
+# Интервальный декодер, парный RangeEncoder
+class RangeDecoder:
+
+    def __init__(self, reader: BitReader, width: int) -> None:
+        self._reader = reader
+        self._width = width
+
+        self._mask = (1 << width) - 1
+        self._top = 1 << (width - 8)
+        self._bot = 1 << (width - 16)
+
+        self._low = 0
+        self._range = self._mask
+        self._code = reader.read_bits(width)
+
+        self.truncations = 0
+
+    def target(self, total: int) -> int:
+        return min((self._code - self._low) // (self._range // total), total - 1)
+
+    def decode(self, low: int, high: int, total: int) -> None:
+        r = self._range // total
+        code_low = self._low + r * low
+        rng = r * (high - low)
+        code = self._code
+
+        top, bot, mask = self._top, self._bot, self._mask
+        read_byte = self._reader.read_byte
+        while True:
+            if (code_low ^ (code_low + rng)) >= top:
+                if rng >= bot:
+                    break
+                rng = -code_low & (bot - 1)
+                self.truncations += 1
+            code = ((code << 8) | read_byte()) & mask
+            code_low = (code_low << 8) & mask
+            rng = (rng << 8) & mask
+
+        self._low, self._range, self._code = code_low, rng, code
+
+
+# Кодек rANS (асимметричные системы счисления) для статической модели
+# Частоты квантуются к сумме 2 ** SCALE_BITS, поэтому декодирование обходится без деления: символ и поправка
+# состояния берутся из таблиц, индексируемых младшими разрядами состояния (слотом)
+# Символы распределяются по lanes состояниям по очереди; все состояния пишут в общий поток байт
+# Кодирование идёт от конца кадра к началу, поэтому вход кодируется кадрами, которые целиком помещаются в память
+class RansCodec:
+    SCALE_BITS = 16
+    LOWER_BOUND = 1 << 23  # Нижняя граница нормализованного состояния; состояние занимает 32 бита
+
+    def __init__(self, frequencies: dict, lanes: int = 2) -> None:
+        self.lanes = lanes
+
+        bits = self.SCALE_BITS
+        self._mask = (1 << bits) - 1
+
+        self._starts = [0] * 256
+        self._frequencies = [0] * 256
+        self._limits = [0] * 256  # Граница состояния, начиная с которой перед кодированием символа выталкивается байт
+
+        # Таблицы слотов: символ, его частота и поправка состояния (слот - начало интервала символа)
+        self._slot_symbols = bytearray(1 << bits)
+        self._slot_frequencies = [0] * (1 << bits)
+        self._slot_biases = [0] * (1 << bits)
+
+        start = 0
+        for symbol, frequency in sorted(frequencies.items()):
+            self._starts[symbol] = start
+            self._frequencies[symbol] = frequency
+            self._limits[symbol] = ((self.LOWER_BOUND >> bits) << 8) * frequency
+
+            self._slot_symbols[start:start + frequency] = bytes([symbol]) * frequency
+            self._slot_frequencies[start:start + frequency] = [frequency] * frequency
+            self._slot_biases[start:start + frequency] = range(0, frequency)
+            start += frequency
+
+    # Кодирование кадра. Байты собираются в обратном порядке и разворачиваются в конце,
+    # а перед ними записываются конечные состояния - с них декодер начинает
+    def encode_frame(self, data) -> bytes:
+        bits, lanes = self.SCALE_BITS, self.lanes
+        starts, frequencies, limits = self._starts, self._frequencies, self._limits
+
+        states = [self.LOWER_BOUND] * lanes
+        out = bytearray()
+
+        for i in range(len(data) - 1, -1, -1):
+            symbol = data[i]
+            lane = i % lanes
+            state = states[lane]
+
+            limit = limits[symbol]
+            while state >= limit:
+                out.append(state & 0xff)
+                state >>= 8
+
+            frequency = frequencies[symbol]
+            states[lane] = ((state // frequency) << bits) + state % frequency + starts[symbol]
+
+        for lane in range(lanes - 1, -1, -1):
+            out += states[lane].to_bytes(4, "big")
+
+        out.reverse()
+        return bytes(out)
+
+    # Декодирование кадра из count символов. Возвращает символы и признак того, что кадр прочитан целиком
+    # и состояния вернулись к начальным значениям кодера
+    def decode_frame(self, data, count: int):
+        bits, mask, lanes, lower_bound = self.SCALE_BITS, self._mask, self.lanes, self.LOWER_BOUND
+        slot_symbols, slot_frequencies, slot_biases = self._slot_symbols, self._slot_frequencies, self._slot_biases
+
+        states = [int.from_bytes(data[4 * lane:4 * lane + 4], "little") for lane in range(lanes)]
+        position = 4 * lanes
+        size = len(data)
+
+        result = bytearray(count)
+        for i in range(count):
+            lane = i % lanes
+            state = states[lane]
+
+            slot = state & mask
+            result[i] = slot_symbols[slot]
+            state = slot_frequencies[slot] * (state >> bits) + slot_biases[slot]
+
+            while state < lower_bound and position < size:
+                state = (state << 8) | data[position]
+                position += 1
+
+            states[lane] = state
+
+        return result, position == size and all(state == lower_bound for state in states)
+
+
+# Модель кодирования, построенная по базовому распределению
+# Накопленные частоты хранятся в плоском массиве, границы символов - в массивах, индексируемых самим символом
+class FrequencyModel:
+
+    def __init__(self, distribution: dict, keys: list, lookup_bits: int = 12) -> None:
+        self.symbols = list(keys)  # Символы в порядке возрастания их интервалов
+
+        # cumulative[i] и cumulative[i + 1] - нижняя и верхняя границы i-го символа
+        self.cumulative = [0] * (len(keys) + 1)
+        self.lows = [0] * 256
+        self.highs = [0] * 256
+
+        for idx, k in enumerate(keys):
+            low, high = distribution[k]
+            self.cumulative[idx] = low
+            self.cumulative[idx + 1] = high
+            self.lows[k] = low
+            self.highs[k] = high
+
+        self.total = self.cumulative[-1]
+
+        # Таблица прямого поиска по старшим разрядам значения: для каждого префикса - индекс первого символа,
+        # интервал которого может содержать значение с таким префиксом. Последний элемент - ограничитель
+        self._shift = max(0, self.total.bit_length() - lookup_bits)
+        self._lookup = [
+            max(0, bisect.bisect_right(self.cumulative, prefix << self._shift) - 1)
+            for prefix in range(((self.total - 1) >> self._shift) + 1)
+        ]
+        self._lookup.append(len(self.symbols) - 1)
+
+    # Границы интервала символа
+    def interval(self, symbol: int):
+        return self.lows[symbol], self.highs[symbol]
+
+    # Поиск индекса символа, интервал которого содержит значение. -1 - если такого нет
+    def find(self, value: int) -> int:
+        if value < 0 or value >= self.total:
+            return -1
+
+        # Таблица сужает поиск до символов одного префикса, среди которых выполняется бинарный поиск
+        prefix = value >> self._shift
+        return bisect.bisect_right(self.cumulative, value, self._lookup[prefix], self._lookup[prefix + 1] + 1) - 1
+
+
+# Дерево Фенвика (двоичное индексированное дерево) для накопленных частот
+# Запрос накопленной частоты, её изменение и поиск символа по накопленной частоте выполняются за O(log n)
+class FenwickTree:
+
+    def __init__(self, frequencies: List[int]) -> None:
+        self._size = len(frequencies)
+        self._top = 1 << (self._size.bit_length() - 1)  # Старшая степень двойки, не превосходящая размер
+        self.rebuild(frequencies)
+
+    # Построение дерева по частотам за O(n)
+    def rebuild(self, frequencies: List[int]) -> None:
+        tree = [0] + list(frequencies)
+        for idx in range(1, self._size + 1):
+            parent = idx + (idx & -idx)
+            if parent <= self._size:
+                tree[parent] += tree[idx]
+        self._tree = tree
+
+    def add(self, idx: int, delta: int) -> None:
+        idx += 1
+        while idx <= self._size:
+            self._tree[idx] += delta
+            idx += idx & -idx
+
+    # Сумма частот символов [0, idx)
+    def prefix(self, idx: int) -> int:
+        result = 0
+        while idx > 0:
+            result += self._tree[idx]
+            idx -= idx & -idx
+        return result
+
+    # Поиск символа, интервал которого содержит накопленную частоту value
+    # Возвращает символ и нижнюю границу его интервала
+    def find(self, value: int):
+        tree = self._tree
+        idx = 0
+        low = 0
+        step = self._top
+        while step:
+            nxt = idx + step
+            if nxt <= self._size and low + tree[nxt] <= value:
+                idx = nxt
+                low += tree[nxt]
+            step >>= 1
+        return idx, low
+
+
+# Адаптивная модель нулевого порядка
+# Частоты обновляются после каждого символа одинаково у кодера и декодера, поэтому их не нужно хранить в заголовке
+# Помимо 256 байт модель содержит символ конца потока, так что длина исходных данных заранее не нужна
+class AdaptiveModel:
+    EOF = 256
+
+    def __init__(self, increment: int = 32, limit: int = 1 << 16) -> None:
+        self._increment = increment  # Приращение частоты символа после его кодирования
+        self._limit = limit  # При превышении суммарной частотой этого значения частоты масштабируются вдвое
+
+        self._frequencies = [1] * 257
+        self._tree = FenwickTree(self._frequencies)
+        self.total = 257
+
+    def _update(self, symbol: int) -> None:
+        self._frequencies[symbol] += self._increment
+        self._tree.add(symbol, self._increment)
+        self.total += self._increment
+
+        # Периодическое масштабирование: частоты уменьшаются вдвое, но не обнуляются
+        if self.total > self._limit:
+            self._frequencies = [(f + 1) >> 1 for f in self._frequencies]
+            self._tree.rebuild(self._frequencies)
+            self.total = sum(self._frequencies)
+
+    def encode(self, encoder, symbol: int) -> None:
+        low = self._tree.prefix(symbol)
+        encoder.encode(low, low + self._frequencies[symbol], self.total)
+        self._update(symbol)
+
+    def decode(self, decoder) -> int:
+        symbol, low = self._tree.find(decoder.target(self.total))
+        decoder.decode(low, low + self._frequencies[symbol], self.total)
+        self._update(symbol)
+        return symbol
+
+
+# Статистика одного контекста: частоты встреченных после него символов и их сумма
+class _Context:
+    __slots__ = ('total', 'counts')
+
+    def __init__(self) -> None:
+        self.total = 0
+        self.counts = dict()
+
+
+# Контекстная модель порядков 1..N в духе PPM (метод C, без исключений)
+# Символ кодируется в самом длинном контексте, где он уже встречался; в остальных кодируется уход (escape)
+# на контекст меньшего порядка. Если символ не встречался даже в контексте нулевого порядка,
+# он кодируется равномерно среди 256 байт и символа конца потока
+# Контексты хранятся в хеш-таблице, ключ - последние k байт вместе с порядком k. При превышении
+# ограничения памяти удаляется старейшая половина контекстов. Кодер и декодер делают это одинаково
+class ContextModel:
+    EOF = 256
+
+    CONTEXT_COST = 200  # Приблизительный объём памяти одного контекста, байт
+    SYMBOL_COST = 80  # Приблизительный объём памяти одной частоты в контексте, байт
+
+    def __init__(self, order: int = 3, memory_limit: int = 64 * 1024 ** 2, limit: int = 4096) -> None:
+        self._order = order
+        self._memory_limit = memory_limit
+        self._limit = limit  # При превышении суммой частот контекста этого значения частоты масштабируются вдвое
+
+        self._masks = [(1 << (8 * k)) - 1 for k in range(order + 1)]
+        self._tags = [k << (8 * order) for k in range(order + 1)]  # Порядок контекста в старших разрядах ключа
+        self._history = 0  # Последние order байт
+
+        self._root = _Context()  # Контекст нулевого порядка не вытесняется
+        self._contexts = dict()
+        self._memory = 0
+
+        self.evictions = 0  # Количество вытеснений контекстов
+
+    # Контексты порядков order..1 для текущей истории. Отсутствующие контексты - None
+    def _lookup(self):
+        history = self._history
+        contexts = self._contexts
+        return [contexts.get(self._tags[k] | (history & self._masks[k])) for k in range(self._order, 0, -1)]
+
+    @staticmethod
+    def _encode_in(encoder, context: _Context, symbol: int) -> bool:
+        counts = context.counts
+        # В пустом контексте уход не кодируется - декодер знает, что символов в нём нет
+        if not counts:
+            return False
+
+        total = context.total + len(counts)
+        if symbol not in counts:
+            encoder.encode(context.total, total, total)
+            return False
+
+        low = 0
+        for s, c in counts.items():
+            if s == symbol:
+                break
+            low += c
+        encoder.encode(low, low + counts[symbol], total)
+        return True
+
+    @staticmethod
+    def _decode_in(decoder, context: _Context) -> int:
+        counts = context.counts
+        if not counts:
+            return -1
+
+        total = context.total + len(counts)
+        target = decoder.target(total)
+        if target >= context.total:
+            decoder.decode(context.total, total, total)
+            return -1
+
+        low = 0
+        for s, c in counts.items():
+            if target < low + c:
+                decoder.decode(low, low + c, total)
+                return s
+            low += c
+        return -1
+
+    def _add(self, context: _Context, symbol: int) -> None:
+        counts = context.counts
+        if symbol in counts:
+            counts[symbol] += 1
+        else:
+            counts[symbol] = 1
+            self._memory += self.SYMBOL_COST
+
+        context.total += 1
+        if context.total > self._limit:
+            for s in counts:
+                counts[s] = (counts[s] + 1) >> 1
+            context.total = sum(counts.values())
+
+    def _update(self, symbol: int) -> None:
+        history = self._history
+        contexts = self._contexts
+
+        for k in range(1, self._order + 1):
+            key = self._tags[k] | (history & self._masks[k])
+            context = contexts.get(key)
+            if context is None:
+                context = _Context()
+                contexts[key] = context
+                self._memory += self.CONTEXT_COST
+            self._add(context, symbol)
+        self._add(self._root, symbol)
+
+        self._history = ((history << 8) | symbol) & self._masks[self._order]
+
+        if self._memory > self._memory_limit:
+            self._evict()
+
+    # Вытеснение старейшей половины контекстов (словарь хранит их в порядке создания)
+    def _evict(self) -> None:
+        contexts = self._contexts
+        for key in list(itertools.islice(contexts, len(contexts) // 2 + 1)):
+            context = contexts.pop(key)
+            self._memory -= self.CONTEXT_COST + self.SYMBOL_COST * len(context.counts)
+        self.evictions += 1
+
+    def encode(self, encoder, symbol: int) -> None:
+        for context in self._lookup():
+            if context is not None and self._encode_in(encoder, context, symbol):
+                break
+        else:
+            if not self._encode_in(encoder, self._root, symbol):
+                encoder.encode(symbol, symbol + 1, 257)
+
+        if symbol != self.EOF:
+            self._update(symbol)
+
+    def decode(self, decoder) -> int:
+        symbol = -1
+        for context in self._lookup():
+            if context is not None:
+                symbol = self._decode_in(decoder, context)
+                if symbol != -1:
+                    break
+        else:
+            symbol = self._decode_in(decoder, self._root)
+            if symbol == -1:
+                symbol = decoder.target(257)
+                decoder.decode(symbol, symbol + 1, 257)
+
+        if symbol != self.EOF:
+            self._update(symbol)
+        return symbol
+
+
+# Сборщик статистики кодирования: время фаз и счётчики событий кодера
+# Передаётся в Arico необязательно; без него кодер не выполняет никакой дополнительной работы,
+# а счётчики, которые можно восстановить по количеству записанных бит, вычисляются один раз в конце фазы
+class AricoStats:
+
+    def __init__(self) -> None:
+        self.timers = dict()  # Время фаз, секунды
+        self.counters = dict()
+        self.params = dict()  # Выбранные параметры кодирования, например ширина кодового слова
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    # Параметры не суммируются: у блоков с разными параметрами запоминается наибольшее значение
+    def set(self, name: str, value: int) -> None:
+        self.params[name] = max(self.params.get(name, value), value)
+
+    # Добавление статистики, собранной в другом процессе (например, при кодировании блока)
+    def merge(self, other: dict) -> None:
+        for name, value in other.get('timers', {}).items():
+            self.timers[name] = self.timers.get(name, 0.0) + value
+        for name, value in other.get('counters', {}).items():
+            self.count(name, value)
+        for name, value in other.get('params', {}).items():
+            self.set(name, value)
+
+    def as_dict(self) -> dict:
+        return {'timers': dict(self.timers), 'counters': dict(self.counters), 'params': dict(self.params)}
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+
+# Обученная статическая модель (общий словарь): частоты байт, собранные по образцам похожих данных
+# Идентификатор - начало SHA-256 таблицы частот, поэтому одинаковые модели имеют одинаковый идентификатор
+# Формат файла модели: ARD, версия DICTIONARY_VERSION, идентификатор (8 байт), разреженная таблица частот, 0x2e
+class AricoDictionary:
+    _loaded = dict()  # Модели, загруженные из файлов в этом процессе: путь -> модель
+    _registry = dict()  # Известные процессу модели: идентификатор -> модель
+
+    def __init__(self, counts: dict) -> None:
+        self.counts = dict(sorted(counts.items()))
+        self.total = sum(self.counts.values())
+        self.id = hashlib.sha256(bytes(Arico._pack_sparse_table(self.counts))).digest()[:8]
+        self._coders = dict()  # Модели кодера и кодеки rANS, уже построенные по этим частотам
+
+    # При передаче в дочерний процесс таблицы кодеров не копируются, а модель берётся из реестра процесса, если она там есть
+    def __reduce__(self):
+        return AricoDictionary._restore, (self.counts,)
+
+    @classmethod
+    def _restore(cls, counts: dict):
+        dictionary = cls(counts)
+        return cls._registry.setdefault(dictionary.id, dictionary)
+
+    # Обучение по образцам: каждый байт встречается хотя бы один раз, поэтому моделью кодируются любые данные
+    @classmethod
+    def train(cls, paths, chunk_size: int = 65536):
+        counts = collections.Counter(range(256))
+        for path in paths:
+            with open(path, 'rb') as f:
+                while chunk := f.read(chunk_size):
+                    counts.update(chunk)
+        return cls(counts).register()
+
+    def register(self):
+        AricoDictionary._registry.setdefault(self.id, self)
+        return AricoDictionary._registry[self.id]
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            f.write(bytes([0x41, 0x52, 0x44, DICTIONARY_VERSION, *self.id, *Arico._pack_sparse_table(self.counts), 0x2e]))
+
+    # Загрузка модели из файла. Каждый файл читается один раз за время работы процесса
+    @classmethod
+    def load(cls, path: str):
+        key = os.path.abspath(path)
+        if key in cls._loaded:
+            return cls._loaded[key]
+
+        with open(path, 'rb') as f:
+            header = f.read(4)
+            if header[:3] != b"ARD":
+                raise InvalidSignatureException()
+            if header[3] != DICTIONARY_VERSION:
+                raise UnsupportedVersionException(header[3])
+            identifier = f.read(8)
+
+            reader = Arico(f, None)
+            dictionary = cls(reader._read_sparse_table())
+            checkpoint = Arico._next_byte(f)
+            if checkpoint != 0x2e:
+                raise InvalidCountsCheckpointByteException(checkpoint)
+            if dictionary.id != identifier:
+                raise InvalidStreamException(f"trained model {path} is corrupted")
+
+        cls._loaded[key] = dictionary.register()
+        return cls._loaded[key]
+
+    @classmethod
+    def find(cls, identifier: bytes):
+        if identifier not in cls._registry:
+            raise DictionaryNotFoundException(identifier.hex())
+        return cls._registry[identifier]
+
+    # Модель кодера для заданных параметров: строится при первом использовании и переиспользуется
+    def coder(self, key: tuple, build):
+        if key not in self._coders:
+            self._coders[key] = build(self.counts)
+        return self._coders[key]
+
+
 class Arico:
     # _digits = string.digits + string.ascii_letters
-    def __init__(self, file, out, width=32, count_scale=0, chunk_size=65536):
+    def __init__(self, file, out, width=32, count_scale=0, chunk_size=65536, spool_size=64 * 1024 ** 2, model='static',
+                 order=3, memory_limit=64 * 1024 ** 2, block_size=0, workers=None, verbose=True, legacy=False,
+                 index=False, engine='arithmetic', lanes=2, use_mmap=False, stats=None, dictionary=None):
 
-        self._file: BinaryIO = file
+        # При use_mmap вход отображается в память, а если это невозможно - читается как обычно
+        self._file: BinaryIO = MappedInput.open(file) if use_mmap else file
         self._out: BinaryIO = out
         # self._data: List[int] = list()
 
         self._length = 0  # Длина исходного потока
-        self._read_bits = 0  # Количество прочитанных бит, вспомогательное поле
-        self._width = width  # Ширина кодового слова
+        # Ширина кодового слова. 'auto' - наименьшая ширина, точная для распределения входа, выбирается после подсчёта статистики
+        self._auto_width = width == 'auto'
+        self._width = 32 if self._auto_width else width
         self._count_scale = count_scale  # Масштабирование частоты на некоторое количество байт. 0 - масштабирование не нужно
 
         self._chunk_size = chunk_size
+        self._spool_size = spool_size  # Объём данных несжимаемого потока, хранимых в памяти, прежде чем они будут перенесены во временный файл
+
+        if model not in MODELS:
+            raise UnsupportedModelException(model)
+        self._model = model  # Модель кодирования: статическая (с таблицей частот в заголовке), адаптивная или контекстная
+
+        if engine not in ENGINES:
+            raise UnsupportedEngineException(engine)
+        self._engine = engine  # Кодер: арифметический на кодовом слове произвольной ширины, интервальный на машинном слове или rANS
+        if lanes not in RANS_LANES:
+            raise InvalidLanesException(lanes)
+        self._lanes = lanes  # Количество чередующихся состояний rANS
+
+        # Параметры контекстной модели: максимальный порядок и ограничение памяти под статистику контекстов, байт
+        self._order = order
+        self._memory_limit = memory_limit
+
+        # Блочный режим: вход разбивается на независимые блоки по block_size байт, которые кодируются
+        # в workers процессах. 0 - блочный режим не используется
+        self._block_size = block_size
+        self._workers = workers or os.cpu_count() or 1
+        self._index = index  # Записывать ли в конец контейнера индекс блоков для декодирования диапазонов
+
+        self._verbose = verbose  # Выводить ли результат проверки декодирования
+
+        # Кодировать ли статическую модель в старом формате (старый заголовок и кодер без обработки исчезновения порядка)
+        # По умолчанию используется расширенный формат с разреженной таблицей частот. Блоки всегда кодируются в расширенном формате
+        self._legacy = legacy
 
         self._last = 0
-        self._chunk_buffer = list()
+
+        self._bits_written = 0  # Количество бит, выданных кодером при последнем кодировании
+        self._checksum = 0  # CRC32 прочитанных кодером исходных данных
+
+        self._stats = stats  # Сборщик статистики AricoStats. None - статистика не собирается
+
+        # Обученная модель AricoDictionary. При кодировании используется вместо подсчёта статистики,
+        # при декодировании - если её идентификатор совпадает с записанным в заголовке
+        self._dictionary = dictionary.register() if dictionary is not None else None
+
+    # Количество бит, записанных кодером (включая дополнение нулями в конце)
+    @property
+    def bits_written(self) -> int:
+        return self._bits_written
+
+    @property
+    def stats(self):
+        return self._stats
+
+    # Замер времени фазы, если статистика собирается
+    def _phase(self, name: str):
+        if self._stats is None:
+            return contextlib.nullcontext()
+        return self._stats.phase(name)
+
+    # Отображённый в память вход освобождается по окончании кодирования или декодирования
+    def _release_input(self):
+        if isinstance(self._file, MappedInput):
+            return self._file
+        return contextlib.nullcontext()
+
+    # Добавление счётчиков в статистику, если она собирается
+    def _record(self, **counters) -> None:
+        if self._stats is not None:
+            for name, value in counters.items():
+                self._stats.count(name, value)
+
+    # Запись выбранных параметров в статистику, если она собирается
+    def _record_params(self, **params) -> None:
+        if self._stats is not None:
+            for name, value in params.items():
+                self._stats.set(name, value)
+
+    # Добавление статистики блока, закодированного или раскодированного исполнителем
+    def _merge_block_stats(self, stats) -> None:
+        if self._stats is not None and stats is not None:
+            self._stats.merge(stats)
+            self._stats.count('blocks')
+
+    # Счётчики кодера, восстановленные по количеству записанных или прочитанных им бит:
+    # арифметический кодер на каждый сдвиг границ выдаёт один бит и ещё width бит при завершении,
+    # интервальный - байт на каждую нормализацию и width / 8 байт при завершении
+    def _record_coder(self, coder, bits: int) -> None:
+        if self._stats is None:
+            return
+        if isinstance(coder, (RangeEncoder, RangeDecoder)):
+            self._record(bits=bits, renormalizations=max(0, bits - self._width) // 8, truncations=coder.truncations)
+        else:
+            self._record(bits=bits, renormalizations=max(0, bits - self._width), underflows=coder.underflows)
 
     # Вспомогательная функция преобразования числа в набор байт
     @staticmethod
@@ -65,6 +1234,19 @@ class Arico:
         # результат будет записан в обратном порядке, потому необходимо отзеркалить его
         return transformed[::-1]
 
+    # Упаковка таблицы из 256 частот, каждая - ровно в item_length байт
+    # С NumPy таблица собирается одним преобразованием массива в байты старшим байтом вперёд
+    @classmethod
+    def _pack_table(cls, values, item_length: int) -> list:
+        if np is not None and 0 < item_length <= 8:
+            table = np.array(values, dtype=np.uint64).astype(">u8").view(np.uint8).reshape(-1, 8)
+            return table[:, 8 - item_length:].ravel().tolist()
+
+        table = list()
+        for value in values:
+            table += cls._int_to_bytes(value, item_length)
+        return table
+
     # Вспомогательный метод считывания следующего байта в файле как целое число
     @staticmethod
     def _next_byte(file):
@@ -73,6 +1255,12 @@ class Arico:
             return -1
         return int.from_bytes(read, "big", signed=False)
 
+    # Вспомогательный метод проверки, поддерживает ли поток перемещение по нему
+    @staticmethod
+    def _is_seekable(file) -> bool:
+        seekable = getattr(file, "seekable", None)
+        return seekable is not None and seekable()
+
     # Вспомогательная функция построения базового распределения
     # Принимает на вход словарь частот
     @staticmethod
@@ -92,77 +1280,66 @@ class Arico:
 
         return distribution, keys
 
-    # Вспомогательная функция записи цифры в выходной поток
-    # Принимает на вход список-назначение, список заполненности байтов и саму цифру
-    @staticmethod
-    def _write_digit(dst: List[int], fills: List[int], digit: int, out: BinaryIO):
-        offset = 1  # Величина сдвига. Может быть необходима, если основание кодового слова будет другим
-
-        fill = fills[-1]
-
-        # Если после сдвига не будет переполнения байта - просто сдвигаем и записываем цифру
-        if fill + offset <= 8:
-            dst[-1] = (dst[-1] << offset) + digit
-            fills[-1] += offset
-        # Иначе излишки сдвигаем в новый разряд, и только затем записываем в конец
-        else:
-            out.write(bytes([(dst[-1] << (8 - fill)) + (digit >> (offset - 8 + fill))]))
-            # dst[-1] = (dst[-1] << (8 - fill)) + (digit >> (offset - 8 + fill))
-            dst[-1] = (digit & (2 ** (offset - 8 + fill) - 1))
-            fills[-1] = (offset - 8 + fill)
-            # fills.append()
-
-    # Вспомогательный метод чтения следующей цифры из входного потока
-    def _read_digit(self):
-
-        # Если достигли конца файла - возвращаем -1 - невозможное значение, которое будет являться флагом конца файла
-        if not self._chunk_buffer:
-            self._chunk_buffer = self._file.read(self._chunk_size)
-            if not self._chunk_buffer:
-                return -1
-
-        # Считываем 1 бит, т.к. основание системы счисления - 2
-        length = 1
-
-        value = self._chunk_buffer[0]
-
-        # Если мы ещё не считали полный байт, то из считанного байта извлекаем нужный разряд,
-        # перемещаем указатель в файле на 1 позицию назад, и возвращаем считанный разряд
-        if self._read_bits + length <= 8:
-            self._read_bits += length
-            result = (value & ((2 ** length - 1) << (8 - self._read_bits))) >> (8 - self._read_bits)
-            if self._read_bits < 8:
-                pass
-            else:
-                self._chunk_buffer = self._chunk_buffer[1:]
-                self._read_bits = 0
-            return result
-
-        # Иначе выясняем, сколько бит надо взять из текущего байта и сколько - из следующего
-        remaining = 8 - self._read_bits
-        taken = (self._read_bits + length) - 8
+    # Построение модели кодирования по словарю частот и длине исходного потока
+    # Используется и кодером, и декодером, поэтому их распределения не могут разойтись
+    def _build_model(self, counts, length):
+        # Сортировка словаря по ключам с масштабированием по ширине кодового слова
+        scaling = 2 ** self._width
+        counts = {ck: cv for ck, cv in sorted(counts.items(), key=lambda x: x[0])}
+        counts = {ck: cv * scaling // length for ck, cv in counts.items()}
 
-        result = value & (2 ** remaining - 1)
+        # Построение распределения
+        distribution, keys = self._build_distribution(counts)
 
-        # Чтение следующего байта, откуда заимствуем разряды
-        if len(self._chunk_buffer) == 1:
-            self._chunk_buffer = self._file.read(self._chunk_size)
-            if not self._chunk_buffer:
-                taken_value = 0
+        return FrequencyModel(distribution, keys)
+
+    # Контрольная сумма исходных данных в конце потока расширенного формата
+    def _write_checksum(self) -> None:
+        self._out.write(self._checksum.to_bytes(4, "big"))
+
+    # Сверка контрольной суммы раскодированных данных с записанной в конце потока. Если кодер читал поток через reader,
+    # сумма берётся из него: часть потока после закодированных данных уже может находиться в его блоке
+    def _verify_checksum(self, reader: BitReader = None) -> None:
+        if not isinstance(self._out, ChecksumWriter):
+            return
+        trailer = reader.read_aligned_bytes(4) if reader is not None else self._file.read(4)
+        if len(trailer) < 4 or int.from_bytes(trailer, "big") != self._out.crc:
+            raise ChecksumMismatchException()
+
+    # Выбор ширины кодового слова в режиме 'auto' по длине входа: наименьшая ширина, при которой кодер принимает
+    # частоты без квантования. Точным частотам масштабирование не нужно, поэтому count_scale сбрасывается в 0
+    def _resolve_width(self, length: int = 0) -> None:
+        if self._auto_width:
+            if self._engine == 'range':
+                # Сумма частот интервального кодера ограничена 2 ** (width - 16)
+                self._width = RANGE_WIDTHS[0] if length <= 1 << (RANGE_WIDTHS[0] - 16) else RANGE_WIDTHS[1]
+            elif self._model == 'adaptive':
+                self._width = 18  # Сумма частот адаптивной модели не превышает 2 ** 16
+            elif self._model == 'ppm':
+                self._width = 16
+            elif self._engine == 'rans':
+                self._width = 32  # Точность rANS задаётся его таблицами, ширина кодового слова не используется
+            elif self._legacy and self._engine == 'arithmetic':
+                # Старый кодер не обрабатывает исчезновение порядка, и интервал может сузиться сильнее четверти диапазона,
+                # поэтому ширина берётся с запасом
+                self._width = max(32, length.bit_length() + 16)
             else:
-                taken_value = self._chunk_buffer[0]
-        else:
-            self._chunk_buffer = self._chunk_buffer[1:]
-            taken_value = self._chunk_buffer[0]
+                # Сумма частот статической модели равна длине входа и не должна превышать четверти диапазона
+                self._width = max(11, (length - 1).bit_length() + 2)
+            self._count_scale = 0
 
-        # Из нового считанного байта извлекаем нужный разряд,
-        # перемещаем указатель в файле на 1 позицию назад, и возвращаем считанный разряд
-        result = (result << taken) + (((2 ** taken - 1) << (8 - taken)) & taken_value) >> (8 - taken)
+        self._record_params(width=self._width, count_scale=self._count_scale)
 
-        # self._file.seek(-1, 1)
-        self._read_bits = taken
+    # Масштабирование частот старого заголовка к диапазону count_scale байт пропорционально длине потока
+    # Встреченный символ сохраняет ненулевую частоту, иначе его нельзя будет раскодировать
+    def _scale_counts(self, counts: dict) -> dict:
+        maximum = 2 ** (8 * self._count_scale) - 1
+        return {k: max(1, v * maximum // self._length) for k, v in counts.items()}
 
-        return result
+    # Восстановление частот по масштабированным значениям; кодер строит модель по тем же восстановленным частотам
+    def _restore_counts(self, scaled: dict, length: int) -> dict:
+        maximum = 2 ** (8 * self._count_scale) - 1
+        return {k: max(1, v * length // maximum) for k, v in scaled.items()}
 
     # Метод упаковки закодированного сообщения в итоговый набор байт с требуемой структурой
     def _pack_header(self, counts):
@@ -170,7 +1347,8 @@ class Arico:
         signature = [0x41, 0x52, 0x49]  # ARI
 
         # Длина длины и ширины кодового слова
-        length_of_length = (self._length.bit_length() + 7) // 8
+        # Для пустого входа длина длины всё равно равна 1: нулевое значение - признак расширенного заголовка
+        length_of_length = (self._length.bit_length() + 7) // 8 or 1
         # length_of_table = len(counts.keys()) - 1
         length_of_width = (self._width.bit_length() + 7) // 8
 
@@ -179,21 +1357,13 @@ class Arico:
         last = self._last  # Записываем последний бит исходного потока для успешного декодирования
 
         length_checkpoint = 0x2e
-        # Упаковка словаря
-        counts_bytes = list()
-        for char in range(256):  # Больше 256 символов быть не может
-            if self._count_scale == 0:
-                if char in counts:
-                    char_bytes = self._int_to_bytes(counts[char], length_of_length)
-                else:  # Если символа нет - записываем 0 как частоту
-                    char_bytes = self._int_to_bytes(0, length_of_length)
-            else:
-                # Если было указано масштабирование частоты на количество байт - выполняем преобразование
-                if char in counts:
-                    char_bytes = self._int_to_bytes((counts[char] // self._length) * (2 ** (8 * self._count_scale) - 1), self._count_scale)
-                else:  # Если символа нет - записываем 0 как частоту
-                    char_bytes = self._int_to_bytes(0, self._count_scale)
-            counts_bytes += char_bytes
+        # Упаковка словаря. Больше 256 символов быть не может; если символа нет - записываем 0 как частоту
+        if self._count_scale == 0:
+            counts_bytes = self._pack_table([counts.get(char, 0) for char in range(256)], length_of_length)
+        else:
+            # Если было указано масштабирование частоты на количество байт - выполняем преобразование
+            scaled = self._scale_counts(counts)
+            counts_bytes = self._pack_table([scaled.get(char, 0) for char in range(256)], self._count_scale)
 
         counts_checkpoint = 0x2e
 
@@ -212,8 +1382,231 @@ class Arico:
             # *encode_result
         ]
 
-    def encode(self):  # noqa: C901
-        counts = dict()
+    # Метод упаковки расширенного заголовка. Параметры модели записываются после ширины кодового слова
+    def _pack_extended_header(self, model_params=()):
+        length_of_width = (self._width.bit_length() + 7) // 8
+
+        return [
+            0x41, 0x52, 0x49,  # ARI
+            0x00,  # Признак расширенного заголовка: в старом формате здесь длина длины, которая не бывает нулевой
+            FORMAT_VERSION,
+            MODELS[self._model],
+            ENGINES[self._engine],
+            length_of_width,
+            *self._int_to_bytes(self._width, length_of_width),
+            *model_params,
+            0x2e,  # header_checkpoint
+        ]
+
+    # Наибольшая сумма частот модели, при которой выбранный кодер с текущей шириной остаётся точным
+    def _total_limit(self) -> int:
+        # Интервальному кодеру после нормализации гарантирован интервал не меньше 2 ** (width - 16)
+        if self._engine == 'range':
+            if self._width not in RANGE_WIDTHS:
+                raise InvalidEngineWidthException(self._engine, self._width, RANGE_WIDTHS)
+            return 1 << (self._width - 16)
+
+        # Арифметическому кодеру - не меньше четверти диапазона кодового слова
+        return 1 << (self._width - 2)
+
+    # Кодер и декодер выбранного движка
+    def _create_encoder(self, writer: BitWriter):
+        if self._engine == 'range':
+            self._total_limit()
+            return RangeEncoder(writer, self._width)
+        return ArithmeticEncoder(writer, self._width)
+
+    def _create_decoder(self, reader: BitReader):
+        if self._engine == 'range':
+            self._total_limit()
+            return RangeDecoder(reader, self._width)
+        return ArithmeticDecoder(reader, self._width)
+
+    # Максимальная суммарная частота адаптивной модели, при которой кодер с текущей шириной остаётся точным
+    def _adaptive_limit(self) -> int:
+        # В сумме частот должно хватать места для всех символов и приращения
+        if self._width < 11:
+            raise InvalidWidthException(self._width, 11)
+        return min(1 << 16, self._total_limit())
+
+    # Параметры модели, записываемые в расширенный заголовок
+    def _model_params(self):
+        if self._model == 'ppm':
+            memory_limit = self._int_to_bytes(self._memory_limit)
+            return [self._order, len(memory_limit), *memory_limit]
+        return []
+
+    # Создание модели для однопроходного кодирования по параметрам из конструктора или заголовка
+    def _create_model(self):
+        # rANS кодирует кадр в обратном порядке и не может следовать за адаптивной моделью символ за символом
+        if self._engine == 'rans':
+            raise UnsupportedEngineException(f"{self._engine} for the {self._model} model")
+
+        if self._model == 'adaptive':
+            return AdaptiveModel(limit=self._adaptive_limit())
+
+        # Сумма частот контекста вместе с уходами не превышает 4096 + 256, что требует ширины не меньше 16 бит
+        if self._width < 16:
+            raise InvalidWidthException(self._width, 16)
+        return ContextModel(self._order, self._memory_limit)
+
+    # Однопроходное кодирование адаптивной или контекстной моделью без таблицы частот в заголовке
+    def _encode_single_pass(self):
+        self._resolve_width()
+        model = self._create_model()
+
+        writer = BitWriter(self._out, self._chunk_size)
+        writer.write_bytes(bytes(self._pack_extended_header(self._model_params())))
+
+        encoder = self._create_encoder(writer)
+
+        with self._phase('code'):
+            while chunk := self._file.read(self._chunk_size):
+                for byte in chunk:
+                    model.encode(encoder, byte)
+                self._length += len(chunk)
+                self._checksum = zlib.crc32(chunk, self._checksum)
+
+            # Символ конца потока заменяет длину в заголовке
+            model.encode(encoder, model.EOF)
+            encoder.finish()
+            writer.flush()
+        self._write_checksum()
+
+        self._bits_written = writer.bits_written
+
+        self._record(symbols=self._length, evictions=getattr(model, 'evictions', 0))
+        self._record_coder(encoder, writer.bits_written)
+
+        return self._bits_written
+
+    # Вспомогательные методы записи и чтения числа вместе с его длиной в байтах
+    @classmethod
+    def _pack_int(cls, value: int):
+        if value == 0:
+            return [0]
+        packed = cls._int_to_bytes(value)
+        return [len(packed), *packed]
+
+    @classmethod
+    def _read_int(cls, file) -> int:
+        length = cls._next_byte(file)
+        if length <= 0:
+            return 0
+        return int.from_bytes(file.read(length), "big", signed=False)
+
+    # Параметры кодирования отдельного блока в блочном режиме
+    def _block_params(self) -> dict:
+        return {
+            'width': 'auto' if self._auto_width else self._width,
+            'count_scale': self._count_scale,
+            'chunk_size': self._chunk_size,
+            'model': self._model,
+            'order': self._order,
+            'memory_limit': self._memory_limit,
+            'legacy': False,
+            'engine': self._engine,
+            'lanes': self._lanes,
+            'dictionary': self._dictionary,
+        }
+
+    # Исполнитель задач блочного режима: пул процессов или, если процесс один, текущий процесс
+    def _executor(self):
+        if self._workers > 1:
+            return concurrent.futures.ProcessPoolExecutor(max_workers=self._workers)
+        return _InlineExecutor()
+
+    # Чтение блока целиком: из каналов read может вернуть меньше запрошенного
+    def _read_block(self) -> bytes:
+        block = self._file.read(self._block_size)
+        while block and len(block) < self._block_size:
+            more = self._file.read(self._block_size - len(block))
+            if not more:
+                break
+            block += more
+        # Блок передаётся в другой процесс, поэтому срез отображённого в память файла копируется
+        return bytes(block)
+
+    # Запись закодированного блока: длина исходного блока, длина закодированного блока, сам блок
+    # Возвращает количество записанных байт
+    def _write_frame(self, length: int, future) -> int:
+        data, bits, stats = future.result()
+        self._merge_block_stats(stats)
+        frame = self._pack_frame_header(length, len(data))
+        self._out.write(frame)
+        self._out.write(data)
+        self._bits_written += bits
+        return len(frame) + len(data)
+
+    # Запись индекса блоков в конец контейнера: длина исходных данных, количество блоков
+    # и для каждого блока - смещение в исходных данных и смещение его записи в контейнере
+    # Завершается смещением самого индекса (8 байт) и сигнатурой ARIX, по которым индекс находится с конца файла
+    def _write_index(self, entries, index_offset: int) -> None:
+        index = [*self._pack_int(self._length), *self._pack_int(len(entries))]
+        for raw_offset, frame_offset in entries:
+            index += [*self._pack_int(raw_offset), *self._pack_int(frame_offset)]
+
+        self._out.write(bytes(index))
+        self._out.write(index_offset.to_bytes(8, "big") + b"ARIX")
+
+    # Заголовок блочного контейнера
+    def _pack_blocks_header(self) -> bytes:
+        return bytes([
+            0x41, 0x52, 0x42,  # ARB
+            FORMAT_VERSION,
+            *self._pack_int(self._block_size),
+            0x2e,  # header_checkpoint
+        ])
+
+    # Начало записи блока: длина исходного блока и длина закодированного блока
+    @classmethod
+    def _pack_frame_header(cls, length: int, size: int) -> bytes:
+        return bytes([*cls._pack_int(length), *cls._pack_int(size)])
+
+    # Блочное кодирование: каждый блок кодируется независимо со своей моделью и состоянием кодера
+    def _encode_blocks(self):
+        header = self._pack_blocks_header()
+        self._out.write(header)
+
+        offset = len(header)  # Смещение следующей записи блока в контейнере
+        entries = list()
+
+        params = self._block_params()
+        with self._executor() as executor:
+            pending = collections.deque()
+            while block := self._read_block():
+                pending.append((len(block), executor.submit(_encode_block, block, params, self._stats is not None)))
+                entries.append((self._length, None))
+                self._length += len(block)
+
+                # Количество одновременно обрабатываемых блоков ограничено, поэтому расход памяти не зависит от размера входа
+                if len(pending) >= 2 * self._workers:
+                    entries[-len(pending)] = (entries[-len(pending)][0], offset)
+                    offset += self._write_frame(*pending.popleft())
+
+            while pending:
+                entries[-len(pending)] = (entries[-len(pending)][0], offset)
+                offset += self._write_frame(*pending.popleft())
+
+        self._out.write(bytes([0x00]))  # Блок нулевой длины - признак конца контейнера
+
+        if self._index:
+            self._write_index(entries, offset + 1)
+
+        return self._bits_written
+
+    # Проход подсчёта статистики. Возвращает словарь частот и временный буфер с данными, если вход нельзя перечитать
+    def _count_symbols(self):
+        counts = collections.Counter()
+
+        # Если по входному потоку нельзя перемещаться (stdin, канал, сокет), то он читается один раз,
+        # а прочитанные данные сохраняются во временный буфер, который переносится на диск при превышении spool_size
+        spool = None
+        if not self._is_seekable(self._file):
+            spool = tempfile.SpooledTemporaryFile(max_size=self._spool_size)
+
+        # С NumPy гистограмма каждого блока считается через bincount, а не побайтовым циклом
+        histogram = np.zeros(256, dtype=np.int64) if np is not None else None
 
         # Считывание данных с файла и построение статистики
         while True:
@@ -221,156 +1614,828 @@ class Arico:
             if not data:
                 break
             self._last = data[-1]
+            self._length += len(data)
+            self._checksum = zlib.crc32(data, self._checksum)
 
-            for elem in data:
-                if elem not in counts:
-                    counts[elem] = 0
-                counts[elem] += 1
-                self._length += 1
+            if spool is not None:
+                spool.write(data)
 
-        # Сортировка словаря по ключам с масштабированием по ширине кодового слова
-        scaling = 2 ** self._width
-        counts = {ck: cv for ck, cv in sorted(counts.items(), key=lambda x: x[0])}
-        pure_counts = copy.deepcopy(counts)
-        counts = {ck: cv * scaling // self._length for ck, cv in counts.items()}
+            if histogram is not None:
+                histogram += np.bincount(np.frombuffer(data, dtype=np.uint8), minlength=256)
+                continue
 
-        # Построение распределения
-        distribution, keys = self._build_distribution(counts)
+            # Counter считает байты в C, а не побайтовым циклом интерпретатора
+            counts.update(data)
+
+        if histogram is not None:
+            return {int(elem): int(histogram[elem]) for elem in np.flatnonzero(histogram)}, spool
+
+        return dict(counts), spool
+
+    # Возврат к началу входных данных для прохода кодирования
+    def _rewind(self, spool):
+        if spool is not None:
+            spool.seek(0)
+            return spool
+        self._file.seek(0)
+        return self._file
+
+    # Квантование частот для статической модели расширенного формата: сумма не превышает total_limit,
+    # наибольшая частота - max_value, а частота каждого встреченного символа остаётся не меньше 1
+    @staticmethod
+    def _quantize_counts(counts: dict, total_limit: int, max_value: int = None) -> dict:
+        quantized = dict(counts)
+
+        largest = max(quantized.values(), default=0)
+        if max_value is not None and largest > max_value:
+            quantized = {k: max(1, v * max_value // largest) for k, v in quantized.items()}
+
+        total = sum(quantized.values())
+        if total > total_limit:
+            budget = total_limit - len(quantized)
+            quantized = {k: max(1, v * budget // total) for k, v in quantized.items()}
+
+        return quantized
+
+    # Квантование частот к сумме ровно 2 ** bits для rANS. Частота каждого встреченного символа остаётся не меньше 1,
+    # а расхождение суммы после округления переносится на самые частые символы
+    @staticmethod
+    def _quantize_power_of_two(counts: dict, bits: int) -> dict:
+        total = sum(counts.values())
+        if total == 0:
+            return dict()
+
+        target = 1 << bits
+        quantized = {k: max(1, v * target // total) for k, v in counts.items()}
+
+        difference = target - sum(quantized.values())
+        for k in sorted(quantized, key=quantized.get, reverse=True):
+            if difference == 0:
+                break
+            change = difference if difference > 0 else -min(-difference, quantized[k] - 1)
+            quantized[k] += change
+            difference -= change
+
+        return quantized
+
+    # Частоты статической модели расширенного формата, согласованные с шириной кодового слова и масштабированием
+    def _static_frequencies(self, counts: dict) -> dict:
+        # Для rANS сумма частот задаётся точностью таблиц кодека, а не шириной кодового слова
+        if self._engine == 'rans':
+            return self._quantize_power_of_two(counts, RansCodec.SCALE_BITS)
+
+        # Сумма частот ограничена точностью кодера, и в ней должно хватать места для всех символов
+        if self._width < 11:
+            raise InvalidWidthException(self._width, 11)
+
+        max_value = 2 ** (8 * self._count_scale) - 1 if self._count_scale else None
+        return self._quantize_counts(counts, self._total_limit(), max_value)
+
+    # Параметры статической модели расширенного формата: длина исходного потока и таблица частот,
+    # по которой модель строится без дополнительного масштабирования
+    def _static_params(self, frequencies: dict):
+        # Для rANS после таблицы записывается количество чередующихся состояний
+        lanes = [self._lanes] if self._engine == 'rans' else []
+        return [*self._pack_int(self._length), *self._pack_sparse_table(frequencies), *lanes]
+
+    # Упаковка чисел в формате varint: по 7 бит в байте, начиная с младших, старший бит - признак продолжения
+    @staticmethod
+    def _pack_varints(values) -> bytearray:
+        packed = bytearray()
+        for value in values:
+            while value >= 0x80:
+                packed.append((value & 0x7f) | 0x80)
+                value >>= 7
+            packed.append(value)
+        return packed
+
+    @staticmethod
+    def _unpack_varints(data) -> list:
+        values = list()
+        value, shift = 0, 0
+        for byte in data:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+            if byte < 0x80:
+                values.append(value)
+                value, shift = 0, 0
+        return values
+
+    # Разреженная таблица частот: битовая карта встреченных символов (32 байта, старший бит - меньший символ),
+    # длина блока частот и частоты встреченных символов в порядке возрастания символов
+    @classmethod
+    def _pack_sparse_table(cls, frequencies: dict) -> list:
+        bitmap = bytearray(32)
+        for char in frequencies:
+            bitmap[char >> 3] |= 0x80 >> (char & 7)
+
+        packed = cls._pack_varints(frequencies[char] for char in sorted(frequencies))
+        return [*bitmap, *cls._pack_int(len(packed)), *packed]
+
+    # Чтение разреженной таблицы частот: битовая карта и блок частот считываются целиком, а не по байту
+    def _read_sparse_table(self) -> dict:
+        bitmap = self._file.read(32)
+        if len(bitmap) != 32:
+            raise InvalidStreamException("frequency table is truncated")
+        chars = [char for char in range(256) if bitmap[char >> 3] & (0x80 >> (char & 7))]
+
+        size = self._read_int(self._file)
+        packed = self._file.read(size)
+        values = self._unpack_varints(packed)
+        if len(packed) != size or len(values) != len(chars):
+            raise InvalidStreamException("frequency table is truncated")
+        return dict(zip(chars, values))
+
+    # Разбор таблицы из 256 частот по item_length байт. Символы с нулевой частотой пропускаются
+    @staticmethod
+    def _unpack_table(table: bytes, item_length: int) -> dict:
+        counts = dict()
+        for char in range(256):
+            count = int.from_bytes(table[char * item_length:(char + 1) * item_length], "big", signed=False)
+            if count != 0:
+                counts[char] = count
+        return counts
+
+    # Кодирование статической моделью в расширенном формате
+    def _encode_static(self):
+        with self._phase('count'):
+            counts, spool = self._count_symbols()
+        with self._phase('model'):
+            self._resolve_width(self._length)
+            frequencies = self._static_frequencies(counts)
+
+        source = self._rewind(spool)
+
+        if self._should_store(counts, frequencies):
+            self._encode_stored(source)
+            if spool is not None:
+                spool.close()
+            return self._bits_written
+
+        writer = BitWriter(self._out, self._chunk_size)
+        writer.write_bytes(bytes(self._pack_extended_header(self._static_params(frequencies))))
+
+        with self._phase('code'):
+            if self._engine == 'rans':
+                self._encode_rans(frequencies, source, writer)
+            else:
+                model = FrequencyModel(*self._build_distribution(dict(sorted(frequencies.items()))))
+                lows, highs, total = model.lows, model.highs, model.total
+
+                encoder = self._create_encoder(writer)
+
+                while chunk := source.read(self._chunk_size):
+                    for byte in chunk:
+                        encoder.encode(lows[byte], highs[byte], total)
+
+                encoder.finish()
+                self._record_coder(encoder, writer.bits_written)
+
+            writer.flush()
+        self._write_checksum()
+
+        if spool is not None:
+            spool.close()
+
+        self._bits_written = writer.bits_written
+        self._record(symbols=self._length)
+
+        return self._bits_written
+
+    # Сжатие не окупается, если ожидаемый размер кода (перекрёстная энтропия нулевого порядка точных частот
+    # относительно таблицы модели) вместе с таблицей частот и завершением кодера не меньше данных без кодирования
+    def _should_store(self, counts: dict, frequencies: dict) -> bool:
+        total = sum(frequencies.values())
+        bits = sum(count * math.log2(total / frequencies[char]) for char, count in counts.items())
+
+        frames = -(-self._length // self._chunk_size)
+        if self._engine == 'rans':
+            overhead = frames * (4 * self._lanes + 2 * len(self._pack_int(self._chunk_size)))
+        else:
+            overhead = self._width // 8 + 1
+        coded = math.ceil(bits / 8) + len(self._pack_sparse_table(frequencies)) + overhead
+
+        return coded >= self._length + frames * len(self._pack_int(self._chunk_size)) + 1
+
+    # Запись данных без кодирования кадрами по chunk_size байт: длина кадра и сам кадр, в конце - кадр нулевой длины
+    # Длина входа заранее не нужна, поэтому и этот режим читает несжимаемый поток за один проход
+    def _encode_stored(self, source) -> int:
+        self._model = 'stored'
+        self._out.write(bytes(self._pack_extended_header()))
+
+        self._length = 0
+        self._checksum = 0
+        frames = 0
+        with self._phase('code'):
+            while chunk := source.read(self._chunk_size):
+                self._out.write(bytes(self._pack_int(len(chunk))))
+                self._out.write(chunk)
+                self._length += len(chunk)
+                self._checksum = zlib.crc32(chunk, self._checksum)
+                frames += 1
+            self._out.write(bytes([0x00]))
+        self._write_checksum()
+
+        self._bits_written = 8 * self._length
+        self._record(symbols=self._length, bits=self._bits_written, frames=frames, stored=1)
+
+        return self._bits_written
+
+    # Модель кодера обученной модели для текущих кодера и ширины: кодек rANS или модель частот
+    def _dictionary_coder(self, dictionary: AricoDictionary):
+        if self._engine == 'rans':
+            return dictionary.coder(('rans', self._lanes), lambda counts: RansCodec(
+                self._quantize_power_of_two(counts, RansCodec.SCALE_BITS), self._lanes))
+
+        if self._width < 11:
+            raise InvalidWidthException(self._width, 11)
+        return dictionary.coder((self._engine, self._width), lambda counts: FrequencyModel(
+            *self._build_distribution(self._quantize_counts(counts, self._total_limit()))))
+
+    # Кодирование кадра арифметическим или интервальным кодером с отдельным завершением
+    def _encode_frame(self, model: FrequencyModel, chunk) -> bytes:
+        frame = io.BytesIO()
+        writer = BitWriter(frame, self._chunk_size)
+        encoder = self._create_encoder(writer)
+
+        lows, highs, total = model.lows, model.highs, model.total
+        for byte in chunk:
+            encoder.encode(lows[byte], highs[byte], total)
+
+        encoder.finish()
+        writer.flush()
+        self._record_coder(encoder, writer.bits_written)
+        return frame.getvalue()
+
+    def _decode_frame(self, model: FrequencyModel, data: bytes, count: int):
+        reader = BitReader(io.BytesIO(data), self._chunk_size)
+        decoder = self._create_decoder(reader)
+
+        symbols, lows, highs, total = model.symbols, model.lows, model.highs, model.total
+        frame = bytearray()
+        for _ in range(count):
+            symbol = symbols[model.find(decoder.target(total))]
+            decoder.decode(lows[symbol], highs[symbol], total)
+            frame.append(symbol)
+
+        self._record_coder(decoder, reader.bits_read)
+        return frame, not reader.exhausted
+
+    # Кодирование обученной моделью: подсчёта статистики нет, и длина входа заранее неизвестна, поэтому вход
+    # кодируется кадрами по chunk_size символов, как в rANS, а поток завершается кадром из нуля символов
+    # В заголовке вместо таблицы частот записывается только идентификатор модели
+    def _encode_dictionary(self):
+        self._model = 'dictionary'
+        self._resolve_width(self._dictionary.total)
+        coder = self._dictionary_coder(self._dictionary)
+
+        lanes = [self._lanes] if self._engine == 'rans' else []
+        writer = BitWriter(self._out, self._chunk_size)
+        writer.write_bytes(bytes(self._pack_extended_header([*self._dictionary.id, *lanes])))
+
+        frames = 0
+        with self._phase('code'):
+            while chunk := self._file.read(self._chunk_size):
+                data = coder.encode_frame(chunk) if self._engine == 'rans' else self._encode_frame(coder, chunk)
+                writer.write_bytes(bytes([*self._pack_int(len(chunk)), *self._pack_int(len(data))]))
+                writer.write_bytes(data)
+                writer.bits_written += 8 * len(data)
+                self._length += len(chunk)
+                self._checksum = zlib.crc32(chunk, self._checksum)
+                frames += 1
+
+            writer.write_bytes(bytes([0x00]))
+            writer.flush()
+        self._write_checksum()
+
+        self._bits_written = writer.bits_written
+        self._record(symbols=self._length, frames=frames)
+        if self._engine == 'rans':
+            self._record(bits=self._bits_written, renormalizations=self._bits_written // 8 - 4 * self._lanes * frames)
+
+        return self._bits_written
+
+    def _decode_dictionary(self, identifier: bytes):
+        if self._dictionary is not None and self._dictionary.id == identifier:
+            dictionary = self._dictionary
+        else:
+            dictionary = AricoDictionary.find(identifier)
+        coder = self._dictionary_coder(dictionary)
+
+        ok = True
+        frames = 0
+        with self._phase('code'):
+            while True:
+                # Длина количества символов кадра: 0 - завершающий кадр, -1 - поток обрезан до него
+                length_of_count = self._next_byte(self._file)
+                if length_of_count <= 0:
+                    ok = ok and length_of_count == 0
+                    break
+
+                count = int.from_bytes(self._file.read(length_of_count), "big", signed=False)
+                data = self._file.read(self._read_int(self._file))
+                if self._engine == 'rans':
+                    frame, frame_ok = coder.decode_frame(data, count)
+                else:
+                    frame, frame_ok = self._decode_frame(coder, data, count)
+                ok = ok and frame_ok and len(frame) == count
+                frames += 1
+
+                self._out.write(frame)
+                self._length += len(frame)
+
+        self._record(symbols=self._length, frames=frames)
+
+        self._verify_checksum()
+        return self._report(ok)
+
+    # Кодирование rANS кадрами по chunk_size символов: количество символов кадра, длина кадра, сам кадр
+    def _encode_rans(self, frequencies: dict, source, writer: BitWriter) -> None:
+        codec = RansCodec(frequencies, self._lanes)
+
+        frames = 0
+        while chunk := source.read(self._chunk_size):
+            data = codec.encode_frame(chunk)
+            writer.write_bytes(bytes([*self._pack_int(len(chunk)), *self._pack_int(len(data))]))
+            writer.write_bytes(data)
+            writer.bits_written += 8 * len(data)
+            frames += 1
+
+        # Кроме байт нормализации кадр содержит только конечные состояния
+        self._record(bits=writer.bits_written, frames=frames,
+                     renormalizations=writer.bits_written // 8 - 4 * self._lanes * frames)
+
+    def encode(self):
+        with self._phase('total'), self._release_input():
+            return self._encode()
+
+    def _encode(self):  # noqa: C901
+        if self._block_size:
+            return self._encode_blocks()
+
+        if self._dictionary is not None:
+            return self._encode_dictionary()
+        if self._model == 'dictionary':
+            raise UnsupportedModelException("dictionary without a trained model")
+
+        if self._model == 'stored':
+            self._resolve_width()
+            return self._encode_stored(self._file)
+
+        if self._model != 'static':
+            return self._encode_single_pass()
+
+        # Старый формат заголовка не содержит идентификатора кодера
+        if not self._legacy or self._engine != 'arithmetic':
+            return self._encode_static()
+
+        with self._phase('count'):
+            counts, spool = self._count_symbols()
+
+        # Построение модели кодирования
+        # При масштабировании модель строится по частотам, которые восстановит декодер, а не по точным
+        with self._phase('model'):
+            self._resolve_width(self._length)
+            pure_counts = copy.deepcopy(counts)
+            if self._count_scale != 0:
+                counts = self._restore_counts(self._scale_counts(counts), self._length)
+            model = self._build_model(counts, self._length)
+            lows, highs = model.lows, model.highs
 
         # Коэффициент масштаба
-        scale = distribution[keys[-1]][1]
+        scale = model.total
 
-        # вспомогательные массивы для записи результата кодирования
-        result = [0]
-        fills = [0]
+        # Маски разрядов кодового слова вычисляются один раз, а не на каждой итерации
+        mask = (1 << self._width) - 1
+        half = 1 << (self._width - 1)
+        quarter = half >> 1
 
         low, high = 0, scale + 1
         power_loss = 0  # Количество бит исчезновения порядка
-
-        written = 0
+        underflows = 0  # Количество исчезновений порядка за всё кодирование
 
         # Кодирование
 
-        self._file.seek(0)
+        source = self._rewind(spool)
+
+        writer = BitWriter(self._out, self._chunk_size)
+        writer.write_bytes(bytes(self._pack_header(pure_counts)))
+
+        with self._phase('code'):
+            while chunk := source.read(self._chunk_size):
+                for byte in chunk:
+
+                    # Пересчёт верхних и нижних границ в зависимости от текущего байта
+                    rng = high - low + 1
+                    high = low + rng * highs[byte] // scale - 1
+                    low = low + rng * lows[byte] // scale
+
+                    # Запись результата кодирования текущего байта
+                    while True:
+
+                        # Количество совпадающих старших разрядов границ
+                        shared = self._width - (low ^ high).bit_length()
+
+                        if shared > 0:  # При совпадении - запись совпадающих бит в выходной поток за один вызов
+                            # Если имело место исчезновение порядка - после первого совпавшего бита выталкиваем инвертированный бит столько раз, сколько было исчезновений
+                            if power_loss != 0:
+                                elder_low = low >> (self._width - 1)
+                                writer.write_bit(elder_low)
+                                writer.write_repeated(elder_low ^ 1, power_loss)
+                                writer.write_bits((low >> (self._width - shared)) & ((1 << (shared - 1)) - 1), shared - 1)
+                                power_loss = 0
+                            else:
+                                writer.write_bits(low >> (self._width - shared), shared)
+
+                            # Смещение границ сразу на все совпавшие разряды с отсечением лишних
+                            low = (low << shared) & mask
+                            high = ((high << shared) | ((1 << shared) - 1)) & mask
+                        # Иначе возможно исчезновение порядка
+                        # Если условия исчезновения выполняются - сдвигаем все разряды, кроме первого,
+                        # на 1 влево и дописываем в верхнюю границу максимальную цифру текущей системы счисления
+                        # Не забываем увеличить счётчик исчезновения порядка
+                        elif low & half == mask and high & mask == 0:
+                            low &= mask - half - quarter
+                            high |= mask
+                            power_loss += 1
+                            underflows += 1
+
+                            low = (low << 1) & mask
+                            high = ((high << 1) | 1) & mask
+                        else:  # Иначе никаких действий предпринимать не надо
+                            break
+
+        # Каждый сдвиг границ выдал один бит, а отложенные биты исчезновения порядка ещё не записаны
+        self._record(symbols=self._length, renormalizations=writer.bits_written + power_loss, underflows=underflows)
 
-        packed = self._pack_header(pure_counts)
-        self._out.write(bytes(packed))
+        # Выталкивание оставшихся бит исчезновения порядка в выходной поток
+        # Вслед за ними записываются остальные разряды нижней границы: иначе декодер восстановит число меньше неё,
+        # и последние символы будут раскодированы неверно
+        elder_low = low >> (self._width - 1)
+        writer.write_bit(elder_low)
+        writer.write_repeated(elder_low ^ 1, power_loss)
+        writer.write_bits(low & (half - 1), self._width - 1)
 
-        while chunk := self._file.read(self._chunk_size):
-            for byte in chunk:
+        # Дополнение нулями до длины, кратной ширине кодового слова, и ещё одним кодовым словом из нулей
+        writer.write_bits(0, (-writer.bits_written) % self._width + self._width)
+        writer.flush()
 
-                # Пересчёт верхних и нижних границ в зависимости от текущего байта
-                rng = high - low + 1
-                high = low + rng * distribution[byte][1] // scale - 1
-                low = low + rng * distribution[byte][0] // scale
+        if spool is not None:
+            spool.close()
 
-                # Запись результата кодирования текущего байта
-                while True:
+        self._bits_written = writer.bits_written
+        self._record(bits=writer.bits_written)
 
-                    # Извлечение старших разрядов
-                    elder_low = low >> (self._width - 1)
-                    elder_high = high >> (self._width - 1)
-
-                    if elder_high == elder_low:  # При совпадении - запись совпадающего бита в выходной поток
-                        self._write_digit(result, fills, elder_low, self._out)
-                        written += 1
-                        # Если имело место исчезновение порядка - выталкиваем инвертированный старший бит верхней границы в выходной поток столько раз, сколько было исчезновений
-                        while power_loss != 0:
-                            k = ((high ^ (2 ** self._width - 1)) & (2 ** self._width))
-                            self._write_digit(result, fills, k, self._out)
-                            written += 1
-                            power_loss -= 1
-                    # Иначе возможно исчезновение порядка
-                    # Если условия исчезновения выполняются - сдвигаем все разряды, кроме первого,
-                    # на 1 влево и дописываем в верхнюю границу максимальную цифру текущей системы счисления
-                    # Не забываем увеличить счётчик исчезновения порядка
-                    elif low & (2 ** (self._width - 1)) == 2 ** self._width - 1 and high & (2 ** self._width - 1) == 0:
-                        low &= (2 ** self._width - 1) - (2 ** (self._width - 1)) - (2 ** (self._width - 2))
-                        high |= (2 ** self._width - 1)
-                        power_loss += 1
-                    else:  # Иначе никаких действий предпринимать не надо
-                        break
+        return self._bits_written
 
-                    # Смещение границ на 1
-                    low <<= 1
-                    high <<= 1
-                    high |= 1
+    # Копирование кадров, записанных без кодирования, до кадра нулевой длины
+    def _decode_stored(self):
+        ok = True
+        frames = 0
+        with self._phase('code'):
+            while True:
+                # Длина длины кадра: 0 - завершающий кадр, -1 - поток обрезан до него
+                length_of_size = self._next_byte(self._file)
+                if length_of_size <= 0:
+                    ok = length_of_size == 0
+                    break
 
-                    # Отсечение лишних разрядов
-                    low &= (2 ** self._width - 1)
-                    high &= (2 ** self._width - 1)
+                size = int.from_bytes(self._file.read(length_of_size), "big", signed=False)
+                frame = self._file.read(size)
+                self._out.write(frame)
+                self._length += len(frame)
+                frames += 1
+                if len(frame) < size:
+                    ok = False
+                    break
 
-        # Выталкивание оставшихся бит исчезновения порядка в выходной поток
-        elder_low = low >> (self._width - 1)
-        self._write_digit(result, fills, elder_low, self._out)
-        written += 1
-        while power_loss != 0:
-            k = ((low ^ (2 ** self._width - 1)) & (2 ** (self._width - 1))) >> 4
-            self._write_digit(result, fills, k, self._out)
-            written += 1
-            power_loss -= 1
-
-        if written % self._width == 0:
-            for _ in range(self._width):
-                self._write_digit(result, fills, 0, self._out)
-        else:
-            while written % self._width != 0:
-                self._write_digit(result, fills, 0, self._out)
-                written += 1
-            for _ in range(self._width):
-                self._write_digit(result, fills, 0, self._out)
+        self._record(symbols=self._length, bits=8 * self._length, frames=frames)
 
-        # Упаковка в байты
+        self._verify_checksum()
+        return self._report(ok)
 
-        return
+    # Декодирование потока адаптивной или контекстной модели до символа конца потока
+    def _decode_single_pass(self):
+        model = self._create_model()
+
+        reader = BitReader(self._file, self._chunk_size)
+        decoder = self._create_decoder(reader)
+
+        with self._phase('code'):
+            buffer = bytearray()
+            while True:
+                symbol = model.decode(decoder)
+                # Если поток закончился раньше символа конца - данные повреждены
+                if symbol == model.EOF or reader.exhausted:
+                    break
+
+                buffer.append(symbol)
+                if len(buffer) >= self._chunk_size:
+                    self._out.write(buffer)
+                    buffer = bytearray()
+
+            self._out.write(buffer)
+            self._length += len(buffer)
+
+        self._record(symbols=self._length, evictions=getattr(model, 'evictions', 0))
+        self._record_coder(decoder, reader.bits_read)
+
+        self._verify_checksum(reader)
+        return self._report(symbol == model.EOF and not reader.exhausted)
+
+    # Декодирование кадров rANS, пока не будет раскодировано length символов
+    def _decode_rans(self, frequencies: dict, length: int):
+        codec = RansCodec(frequencies, self._lanes)
+        frames = 0
+        size = 0  # Количество байт данных в кадрах
+
+        with self._phase('code'):
+            ok = True
+            while self._length < length:
+                count = self._read_int(self._file)
+                data = self._file.read(self._read_int(self._file))
+                if not count:  # Поток закончился раньше, чем были раскодированы все символы
+                    ok = False
+                    break
+
+                frame, frame_ok = codec.decode_frame(data, count)
+                ok = ok and frame_ok
+                frames += 1
+                size += len(data)
+
+                self._out.write(frame)
+                self._length += len(frame)
+
+        self._record(symbols=self._length, bits=8 * size, frames=frames, renormalizations=size - 4 * self._lanes * frames)
+
+        self._verify_checksum()
+        return self._report(ok and self._length == length)
+
+    # Декодирование статической модели расширенного формата: раскодируется ровно length символов
+    def _decode_static(self, frequencies: dict, length: int):
+        if self._engine == 'rans':
+            return self._decode_rans(frequencies, length)
+
+        reader = BitReader(self._file, self._chunk_size)
 
-    def decode(self):  # noqa: C901
+        model = FrequencyModel(*self._build_distribution(dict(sorted(frequencies.items()))))
+        symbols, lows, highs, total = model.symbols, model.lows, model.highs, model.total
+
+        decoder = self._create_decoder(reader)
+
+        with self._phase('code'):
+            buffer = bytearray()
+            for _ in range(length):
+                symbol = symbols[model.find(decoder.target(total))]
+                decoder.decode(lows[symbol], highs[symbol], total)
+
+                buffer.append(symbol)
+                if len(buffer) >= self._chunk_size:
+                    self._out.write(buffer)
+                    self._length += len(buffer)
+                    buffer = bytearray()
+
+            self._out.write(buffer)
+            self._length += len(buffer)
+
+        self._record(symbols=self._length)
+        self._record_coder(decoder, reader.bits_read)
+
+        self._verify_checksum(reader)
+        return self._report(self._length == length and not reader.exhausted)
+
+    # Декодирование потока с расширенным заголовком. Сигнатура и признак расширенного заголовка уже считаны
+    def _decode_extended(self):
+        version = self._next_byte(self._file)
+        if version not in SUPPORTED_VERSIONS:
+            raise UnsupportedVersionException(version)
+        if version >= CHECKSUM_VERSION:
+            self._out = ChecksumWriter(self._out)
+
+        model_id = self._next_byte(self._file)
+        models = {v: k for k, v in MODELS.items()}
+        if model_id not in models:
+            raise UnsupportedModelException(model_id)
+        self._model = models[model_id]
+
+        engine_id = self._next_byte(self._file)
+        engines = {v: k for k, v in ENGINES.items()}
+        if engine_id not in engines:
+            raise UnsupportedEngineException(engine_id)
+        self._engine = engines[engine_id]
+
+        length_of_width = self._next_byte(self._file)
+        self._width = int.from_bytes(self._file.read(length_of_width), "big", signed=False)
+        self._record_params(width=self._width)
+
+        params = self._read_model_params(version)
+
+        header_checkpoint = self._next_byte(self._file)
+        if header_checkpoint != 0x2e:
+            raise InvalidHeaderCheckpointByteException(header_checkpoint)
+
+        decoders = {'static': self._decode_static, 'stored': self._decode_stored, 'dictionary': self._decode_dictionary}
+        return decoders.get(self._model, self._decode_single_pass)(*params)
+
+    # Чтение параметров модели из расширенного заголовка. Возвращает аргументы, с которыми вызывается декодер модели
+    def _read_model_params(self, version: int) -> tuple:
+        if self._model == 'ppm':
+            self._order = self._next_byte(self._file)
+            length_of_limit = self._next_byte(self._file)
+            self._memory_limit = int.from_bytes(self._file.read(length_of_limit), "big", signed=False)
+
+        if self._model == 'dictionary':
+            identifier = self._file.read(8)
+            if self._engine == 'rans':
+                self._read_lanes()
+            return (identifier,)
+
+        if self._model == 'static':
+            length = self._read_int(self._file)
+            if version == 2:
+                length_of_frequency = self._next_byte(self._file)
+                frequencies = self._unpack_table(self._file.read(256 * length_of_frequency), length_of_frequency)
+            else:
+                frequencies = self._read_sparse_table()
+            if self._engine == 'rans':
+                self._read_lanes()
+            return frequencies, length
+
+        return ()
+
+    # Чтение количества состояний rANS из заголовка
+    def _read_lanes(self):
+        self._lanes = self._next_byte(self._file)
+        if self._lanes not in RANS_LANES:
+            raise InvalidLanesException(self._lanes)
+
+    # Запись раскодированного блока. Возвращает результат его проверки
+    def _write_block(self, length: int, future) -> bool:
+        data, ok, stats = future.result()
+        self._merge_block_stats(stats)
+        self._out.write(data)
+        self._length += len(data)
+        return ok and len(data) == length
+
+    # Декодирование блочного контейнера. Блоки раскодируются параллельно, а записываются в исходном порядке
+    def _decode_blocks(self):
+        self._read_blocks_header()
+
+        ok = True
+        with self._executor() as executor:
+            pending = collections.deque()
+            while length := self._read_int(self._file):
+                data = bytes(self._file.read(self._read_int(self._file)))
+                pending.append((length, executor.submit(_decode_block, data, self._stats is not None, self._dictionary)))
+
+                if len(pending) >= 2 * self._workers:
+                    ok = self._write_block(*pending.popleft()) and ok
+
+            while pending:
+                ok = self._write_block(*pending.popleft()) and ok
+
+        return self._report(ok)
+
+    # Чтение заголовка блочного контейнера (после сигнатуры)
+    def _read_blocks_header(self) -> None:
+        version = self._next_byte(self._file)
+        if version not in SUPPORTED_VERSIONS:
+            raise UnsupportedVersionException(version)
+
+        self._block_size = self._read_int(self._file)
+
+        header_checkpoint = self._next_byte(self._file)
+        if header_checkpoint != 0x2e:
+            raise InvalidHeaderCheckpointByteException(header_checkpoint)
+
+    # Построение индекса блоков: из конца контейнера, если индекс был записан, иначе - просмотром записей блоков
+    # Возвращает длину исходных данных и список пар (смещение в исходных данных, смещение записи блока)
+    def _load_block_index(self):
+        data_offset = self._file.tell()
+
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() - data_offset >= 12:
+            self._file.seek(-12, os.SEEK_END)
+            footer = self._file.read(12)
+            if footer[8:] == b"ARIX":
+                self._file.seek(int.from_bytes(footer[:8], "big"))
+                length = self._read_int(self._file)
+                entries = [(self._read_int(self._file), self._read_int(self._file)) for _ in range(self._read_int(self._file))]
+                return length, entries
+
+        self._file.seek(data_offset)
+        length = 0
+        entries = list()
+        while True:
+            frame_offset = self._file.tell()
+            block_length = self._read_int(self._file)
+            if not block_length:
+                break
+            entries.append((length, frame_offset))
+            length += block_length
+            self._file.seek(self._read_int(self._file), os.SEEK_CUR)
+
+        return length, entries
+
+    # Декодирование только тех блоков, которые покрывают диапазон [start, start + length) исходных данных
+    # Выходной поток получает ровно байты этого диапазона
+    def decode_range(self, start: int, length: int) -> bool:
+        with self._release_input():
+            return self._decode_range(start, length)
+
+    def _decode_range(self, start: int, length: int) -> bool:
+        signature = [self._next_byte(self._file) for _ in range(3)]
+        if signature != [0x41, 0x52, 0x42] or not self._is_seekable(self._file):
+            raise RangeNotSupportedException()
+
+        self._read_blocks_header()
+        total_length, entries = self._load_block_index()
+
+        end = min(start + length, total_length)
+        if start >= end:
+            return self._report(True)
+
+        # Блоки с первого, начинающегося не позже start, до последнего, начинающегося раньше end
+        first = bisect.bisect_right(entries, (start, float("inf"))) - 1
+        last = bisect.bisect_left(entries, (end, -1))
+
+        ok = True
+        with self._executor() as executor:
+            pending = collections.deque()
+            for raw_offset, frame_offset in entries[first:last]:
+                self._file.seek(frame_offset)
+                block_length = self._read_int(self._file)
+                data = bytes(self._file.read(self._read_int(self._file)))
+                pending.append((raw_offset, block_length, executor.submit(_decode_block, data, self._stats is not None, self._dictionary)))
+
+                if len(pending) >= 2 * self._workers:
+                    ok = self._write_range_block(start, end, *pending.popleft()) and ok
+
+            while pending:
+                ok = self._write_range_block(start, end, *pending.popleft()) and ok
+
+        return self._report(ok)
+
+    # Запись пересечения раскодированного блока с диапазоном [start, end). Возвращает результат проверки блока
+    def _write_range_block(self, start: int, end: int, raw_offset: int, block_length: int, future) -> bool:
+        data, ok, stats = future.result()
+        self._merge_block_stats(stats)
+
+        piece = data[max(start - raw_offset, 0):end - raw_offset]
+        self._out.write(piece)
+        self._length += len(piece)
+        return ok and len(data) == block_length
+
+    # Вывод результата проверки декодирования
+    def _report(self, ok: bool) -> bool:
+        if self._verbose:
+            print("OK" if ok else "FAIL")
+        return ok
+
+    def decode(self):
+        with self._phase('total'), self._release_input():
+            return self._decode()
+
+    def _decode(self):  # noqa: C901
         # Проверка сигнатуры и считывание длин
-        signature_ok = all([
-            self._next_byte(self._file) == 0x41,
-            self._next_byte(self._file) == 0x52,
-            self._next_byte(self._file) == 0x49,
-        ])
+        signature = [self._next_byte(self._file) for _ in range(3)]
+
+        # ARB - контейнер из независимо закодированных блоков
+        if signature == [0x41, 0x52, 0x42]:
+            return self._decode_blocks()
 
-        if not signature_ok:
+        if signature != [0x41, 0x52, 0x49]:
             raise InvalidSignatureException()
 
         # Считывание длин (в частности - длины исходного потока и ширины кодового слова), и последнего байта исходной последовательности
         length_of_length = self._next_byte(self._file)
-        # length_of_table = self._next_byte(self._file) + 1
-        length_of_width = self._next_byte(self._file)
 
-        length = list()
-        for _ in range(length_of_length):
-            length.append(self._next_byte(self._file))
+        # Нулевая длина длины - признак расширенного заголовка
+        if length_of_length == 0:
+            return self._decode_extended()
 
-        length = int.from_bytes(length, "big", signed=False)
+        # length_of_table = self._next_byte(self._file) + 1
+        length_of_width = self._next_byte(self._file)
 
-        width = list()
-        for _ in range(length_of_width):
-            width.append(self._next_byte(self._file))
+        # Длина, ширина, масштабирование, последний байт и контрольная точка считываются одним вызовом
+        fields = self._file.read(length_of_length + length_of_width + 3)
+        if len(fields) < length_of_length + length_of_width + 3:
+            raise InvalidLengthCheckpointByteException(-1)
 
-        self._count_scale = self._next_byte(self._file)
-        last = self._next_byte(self._file)
+        length = int.from_bytes(fields[:length_of_length], "big", signed=False)
+        self._width = int.from_bytes(fields[length_of_length:length_of_length + length_of_width], "big", signed=False)
+        self._count_scale, last, length_checkpoint = fields[length_of_length + length_of_width:]
+        self._record_params(width=self._width, count_scale=self._count_scale)
 
-        self._width = int.from_bytes(width, "big", signed=False)
-        length_checkpoint = self._next_byte(self._file)
         # Должен дойти до контрольной точки
         if length_checkpoint != 0x2e:
             raise InvalidLengthCheckpointByteException(length_checkpoint)
 
-        # Считывание частот
-        counts = dict()
-        for char in range(256):
-            count = list()
-            for __ in range(length_of_length):
-                count.append(self._next_byte(self._file))
-            count = int.from_bytes(count, "big", signed=False)
-            if count != 0:  # Нет смысла записывать символ с нулевой частотой
-                if self._count_scale == 0:
-                    counts[char] = count
-                else:  # Если имело место масштабирование частоты по количеству байт на них, то восстанавливаем её
-                    counts[char] = (count * length) // (2 ** (8 * self._count_scale) - 1)
+        # Считывание частот. При масштабировании каждая частота занимает count_scale байт, иначе - length_of_length
+        item_length = self._count_scale or length_of_length
+        counts = self._unpack_table(self._file.read(256 * item_length), item_length)
+        if self._count_scale != 0:  # Если имело место масштабирование частоты по количеству байт на них, то восстанавливаем её
+            counts = self._restore_counts(counts, length)
 
         counts_checkpoint = self._next_byte(self._file)
         # Должен дойти до контрольной точки
@@ -378,33 +2443,21 @@ class Arico:
             raise InvalidCountsCheckpointByteException(counts_checkpoint)
 
         # Считывание закодированного числа и представление в виде кода
-        code = 0
-
-        it = 0
-        while it < self._width:
-            dig = self._read_digit()
-            if dig == -1:
-                break
-            else:
-                code = (code << 1) | dig
-                it += 1
-
-        # Если во время чтения было считано меньше ширины кодового слова - дополнить нулями до помещения в длину
-        if it != self._width:
-            while it < self._width:
-                code <<= 1
-
-        # Сортировка словаря по ключам
-        scaling = 2 ** self._width
-        counts = {ck: cv for ck, cv in sorted(counts.items(), key=lambda x: x[0])}
-        counts = {ck: cv * scaling // length for ck, cv in counts.items()}
+        # Если во время чтения было считано меньше ширины кодового слова - недостающие разряды дополняются нулями
+        reader = BitReader(self._file, self._chunk_size)
+        code = reader.read_bits(self._width)
 
-        # Построение распределения
-        distribution, keys = self._build_distribution(counts)
+        # Построение той же модели, что и при кодировании
+        model = self._build_model(counts, length)
+        symbols, lows, highs = model.symbols, model.lows, model.highs
 
-        scale = distribution[keys[-1]][1]
+        scale = model.total
         decode_result: int = 0
 
+        mask = (1 << self._width) - 1
+        half = 1 << (self._width - 1)
+        quarter = half >> 1
+
         # Установка нижней и верхней границы
         low, high = 0, scale + 1
 
@@ -412,68 +2465,572 @@ class Arico:
 
         rd = 0  # Количество раскодированных байт
 
-        # Декодирование
-        while not eof and rd < length:
+        underflows = 0
 
-            # Определение закодированного байта
-            rng = high - low + 1
-            value = ((code - low + 1) * scale - 1) // rng
+        # Раскодированные байты накапливаются в буфере. Последний байт в поток не сбрасывается:
+        # в конце он заменяется байтом last из заголовка, поэтому перемещаться назад по выходному потоку не нужно
+        buffer = bytearray()
 
-            for k, v in distribution.items():
-                if v[0] <= value < v[1]:
-                    decode_result = k
-                    self._out.write(bytes([k]))
-                    # decode_result.append(k)
-                    break
+        with self._phase('code'):
+            # Декодирование
+            while not eof and rd < length:
 
-            # Пересчёт границ
-            high = low + rng * distribution[decode_result][1] // scale - 1
-            low = low + rng * distribution[decode_result][0] // scale
+                # Определение закодированного байта
+                rng = high - low + 1
+                value = ((code - low + 1) * scale - 1) // rng
 
-            # Классические тесты на исчезновение порядка и считывание следующей цифры
-            while True:
+                idx = model.find(value)
+                if idx != -1:
+                    decode_result = symbols[idx]
+                    buffer.append(decode_result)
+                    if len(buffer) > self._chunk_size:
+                        self._out.write(buffer[:-1])
+                        del buffer[:-1]
 
-                elder_low = low >> (self._width - 1)
-                elder_high = high >> (self._width - 1)
+                # Пересчёт границ
+                high = low + rng * highs[decode_result] // scale - 1
+                low = low + rng * lows[decode_result] // scale
 
-                if elder_high == elder_low:
-                    pass
-                elif low & (2 ** (self._width - 1)) == 2 ** (self._width - 1) and high & (2 ** (self._width - 1)) == 0:
-                    low &= (2 ** self._width - 1) - (2 ** (self._width - 1)) - (2 ** (self._width - 2))
-                    high |= (2 ** (self._width - 1))
-                    code ^= (2 ** (self._width - 1))
-                else:
-                    break
+                # Классические тесты на исчезновение порядка и считывание следующей цифры
+                while True:
 
-                # Сдвиг и считывание следующей цифры
-                low <<= 1
-                high <<= 1
-                high |= 1
+                    # Количество совпадающих старших разрядов границ
+                    shared = self._width - (low ^ high).bit_length()
 
-                low &= (2 ** self._width - 1)
-                high &= (2 ** self._width - 1)
+                    if shared > 0:
+                        # Сдвиг сразу на все совпавшие разряды и считывание стольких же цифр
+                        low = (low << shared) & mask
+                        high = ((high << shared) | ((1 << shared) - 1)) & mask
 
-                next_digit = self._read_digit()
-                if next_digit == -1:
-                    # Если файл закончился, то завершить декодирование
-                    # code <<= 1
-                    eof = True
-                    break
+                        next_digits = reader.read_bits(shared)
+                    elif low & half == half and high & half == 0:
+                        low &= mask - half - quarter
+                        high |= half
+                        code ^= half
+                        underflows += 1
 
-                # Иначе добавить считанную цифру
-                code = (code << 1) | next_digit
-                # Отсечение лишних разрядов
-                code &= (2 ** self._width - 1)
+                        # Сдвиг и считывание следующей цифры
+                        low = (low << 1) & mask
+                        high = ((high << 1) | 1) & mask
 
-            rd += 1
+                        shared = 1
+                        next_digits = reader.read_bit()
+                    else:
+                        break
 
-        if rd == length:
-            print("OK")
-        else:
-            print("FAIL")
-        self._out.seek(-1, 1)
-        self._out.write(bytes([last]))
+                    if reader.exhausted:
+                        # Если файл закончился, то завершить декодирование
+                        eof = True
+                        break
+
+                    # Иначе добавить считанные цифры с отсечением лишних разрядов
+                    code = ((code << shared) | next_digits) & mask
+
+                rd += 1
+
+        # Пустому входу дописывать нечего
+        if buffer:
+            buffer[-1] = last
+        self._out.write(buffer)
+
+        self._record(symbols=rd, bits=reader.bits_read, renormalizations=max(0, reader.bits_read - self._width),
+                     underflows=underflows)
+        return self._report(rd == length)
+
+
+# Исполнитель, выполняющий задачи сразу в текущем процессе
+class _InlineExecutor(concurrent.futures.Executor):
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+
+# Статистика блока для передачи из дочернего процесса. Общее время блока не учитывается: его измеряет вызывающий
+def _block_stats(stats):
+    if stats is None:
+        return None
+    stats.timers.pop('total', None)
+    return stats.as_dict()
+
+
+# Кодирование одного блока (в том числе в дочернем процессе)
+# Возвращает закодированный блок, количество записанных бит и статистику блока (None, если она не собирается)
+def _encode_block(block: bytes, params: dict, collect_stats: bool = False):
+    out = io.BytesIO()
+    stats = AricoStats() if collect_stats else None
+    bits = Arico(io.BytesIO(block), out, verbose=False, stats=stats, **params).encode()
+    return out.getvalue(), bits, _block_stats(stats)
+
+
+# Декодирование одного блока. Возвращает раскодированный блок, результат его проверки и статистику блока
+def _decode_block(data: bytes, collect_stats: bool = False, dictionary=None):
+    out = io.BytesIO()
+    stats = AricoStats() if collect_stats else None
+    ok = Arico(io.BytesIO(data), out, verbose=False, stats=stats, dictionary=dictionary).decode()
+    return out.getvalue(), ok, _block_stats(stats)
+
+
+# Инкрементальный кодер в духе zlib.compressobj: данные подаются частями через feed, а завершаются вызовом flush
+# Результат - блочный контейнер, который раскодируется и Arico.decode, и AricoDecompressor
+# Во внутреннем буфере хранится меньше одного блока входных данных, поэтому расход памяти не зависит от размера входа
+class AricoCompressor:
+
+    def __init__(self, width=32, count_scale=0, model='static', order=3, memory_limit=64 * 1024 ** 2,
+                 block_size=1024 ** 2, engine='arithmetic', lanes=2, chunk_size=65536, dictionary=None) -> None:
+        if block_size < 1:
+            raise ValueError("block_size must be positive")
+
+        # Параметры проверяются и упаковываются тем же Arico, что кодирует блоки. Обученная модель входит в параметры блока
+        self._arico = Arico(None, None, width, count_scale, chunk_size, model=model, order=order,
+                            memory_limit=memory_limit, block_size=block_size, engine=engine, lanes=lanes,
+                            dictionary=dictionary)
+        self._params = self._arico._block_params()
+        self._block_size = block_size
+
+        self._buffer = bytearray()
+        self._started = False  # Записан ли заголовок контейнера
+        self._finished = False
+
+    # Заголовок контейнера выдаётся вместе с первыми данными
+    def _header(self) -> bytes:
+        if self._started:
+            return b""
+        self._started = True
+        return self._arico._pack_blocks_header()
+
+    @staticmethod
+    def _pack_block(block: bytes, data: bytes) -> bytes:
+        return Arico._pack_frame_header(len(block), len(data)) + data
+
+    # Отделение от буфера блоков, готовых к кодированию. При завершении отдаётся и неполный последний блок
+    def _take_blocks(self, data=b"", final: bool = False) -> list:
+        if self._finished:
+            raise ValueError("AricoCompressor is already flushed")
+        self._finished = final
+
+        self._buffer += data
+        blocks = list()
+        while len(self._buffer) >= self._block_size or (final and self._buffer):
+            blocks.append(bytes(self._buffer[:self._block_size]))
+            del self._buffer[:self._block_size]
+        return blocks
+
+    # Приём очередной части данных. Возвращает закодированные блоки, которые удалось сформировать
+    def feed(self, data) -> bytes:
+        out = bytearray(self._header())
+        for block in self._take_blocks(data):
+            out += self._pack_block(block, _encode_block(block, self._params)[0])
+        return bytes(out)
+
+    # Кодирование остатка и завершение контейнера. После flush кодер больше не принимает данные
+    def flush(self) -> bytes:
+        if self._finished:
+            return b""
+
+        out = bytearray(self._header())
+        for block in self._take_blocks(final=True):
+            out += self._pack_block(block, _encode_block(block, self._params)[0])
+
+        out.append(0x00)  # Блок нулевой длины - признак конца контейнера
+        return bytes(out)
+
+
+# Инкрементальный декодер в духе zlib.decompressobj для блочного контейнера
+# Блок раскодируется, как только получен целиком, поэтому в буфере хранится не больше одной записи блока
+# Данные после конца контейнера (например, индекс блоков) сохраняются в unused_data
+class AricoDecompressor:
+
+    def __init__(self, dictionary=None) -> None:
+        self._buffer = bytearray()
+        self._header_read = False
+
+        # Обученная модель передаётся декодеру блока явно, как в AricoArchive
+        self._dictionary = dictionary.register() if dictionary is not None else None
+
+        self.eof = False  # Достигнут ли конец контейнера
+        self.unused_data = b""
+
+    # Чтение числа вместе с его длиной из буфера. Возвращает число и позицию за ним или None, если данных не хватает
+    def _take_int(self, position: int):
+        if position >= len(self._buffer):
+            return None
+        length = self._buffer[position]
+        if position + 1 + length > len(self._buffer):
+            return None
+        return int.from_bytes(self._buffer[position + 1:position + 1 + length], "big", signed=False), position + 1 + length
+
+    def _read_header(self) -> bool:
+        if len(self._buffer) < 4:
+            return False
+        if self._buffer[:3] != b"ARB":
+            raise InvalidSignatureException()
+        if self._buffer[3] not in SUPPORTED_VERSIONS:
+            raise UnsupportedVersionException(self._buffer[3])
+
+        taken = self._take_int(4)
+        if taken is None or taken[1] >= len(self._buffer):
+            return False
+        _, position = taken
+
+        if self._buffer[position] != 0x2e:
+            raise InvalidHeaderCheckpointByteException(self._buffer[position])
+
+        del self._buffer[:position + 1]
+        self._header_read = True
+        return True
+
+    # Отделение от буфера записей блоков, полученных целиком. Возвращает пары (длина блока, закодированный блок)
+    def _take_frames(self, data) -> list:
+        if self.eof:
+            self.unused_data += bytes(data)
+            return []
+
+        self._buffer += data
+        if not self._header_read and not self._read_header():
+            return []
+
+        frames = list()
+        while True:
+            taken = self._take_int(0)
+            if taken is None:
+                break
+            length, position = taken
+
+            if length == 0:
+                self.eof = True
+                self.unused_data = bytes(self._buffer[position:])
+                self._buffer = bytearray()
+                break
+
+            taken = self._take_int(position)
+            if taken is None:
+                break
+            size, position = taken
+            if position + size > len(self._buffer):
+                break
+
+            frames.append((length, bytes(self._buffer[position:position + size])))
+            del self._buffer[:position + size]
+
+        return frames
+
+    # Проверка раскодированного блока
+    @staticmethod
+    def _check_block(length: int, result) -> bytes:
+        block, ok, _ = result
+        if not ok or len(block) != length:
+            raise InvalidStreamException("block failed to decode")
+        return block
+
+    # Приём очередной части контейнера. Возвращает данные всех блоков, полученных целиком
+    def feed(self, data) -> bytes:
+        out = bytearray()
+        for length, frame in self._take_frames(data):
+            out += self._check_block(length, _decode_block(frame, False, self._dictionary))
+        return bytes(out)
+
+    # Завершение декодирования. Контейнер должен быть получен целиком
+    def flush(self) -> bytes:
+        if not self.eof:
+            raise InvalidStreamException("container is truncated")
+        return b""
+
+
+# Кодирование одного файла многофайлового архива (в том числе в дочернем процессе): файл читается прямо в нём
+# Возвращает закодированный файл и его исходный размер
+def _encode_entry(path: str, params: dict):
+    out = io.BytesIO()
+    with open(path, 'rb') as f:
+        Arico(f, out, verbose=False, **params).encode()
+        size = f.tell()
+    return out.getvalue(), size
+
+
+# Многофайловый архив: файлы кодируются независимо (каждый - обычным потоком со своей моделью) и записываются подряд,
+# а в конце архива находится оглавление с именами, смещениями, размерами и моделями файлов
+# Формат: ARM, версия, 0x2e, потоки файлов, оглавление, смещение оглавления (8 байт) и сигнатура ARMT
+class AricoArchive:
+
+    def __init__(self, file, workers=None, dictionary=None) -> None:
+        self._file = file
+        self._workers = workers or os.cpu_count() or 1
+        self._entries = None  # Оглавление, прочитанное из архива
+
+        # Обученная модель: файлы кодируются ею, а при декодировании она передаётся исполнителю явно,
+        # потому что дочерний процесс, запущенный не через fork, не видит реестр моделей родителя
+        self._dictionary = dictionary.register() if dictionary is not None else None
+
+    # Исполнитель, как в блочном режиме Arico: пул процессов или, если процесс один, текущий процесс
+    def _executor(self):
+        if self._workers > 1:
+            return concurrent.futures.ProcessPoolExecutor(max_workers=self._workers)
+        return _InlineExecutor()
+
+    # Список файлов для архивации: пары (имя в архиве, путь)
+    # Каталог обходится рекурсивно, а обычный файл считается списком путей, по одному в строке
+    @staticmethod
+    def collect(path: str) -> list:
+        if os.path.isdir(path):
+            entries = list()
+            for root, directories, files in os.walk(path):
+                directories.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    entries.append((os.path.relpath(file_path, path).replace(os.sep, '/'), file_path))
+            return entries
+
+        # Имя в архиве - путь из списка без диска, корня и переходов к родительскому каталогу, как в tar
+        with open_stream(path, 'rb') as f:
+            lines = f.read().decode('utf8').splitlines()
+        entries = list()
+        for line in filter(None, (line.strip() for line in lines)):
+            parts = os.path.normpath(os.path.splitdrive(line)[1]).replace(os.sep, '/').split('/')
+            entries.append(('/'.join(part for part in parts if part not in ('', '.', '..')), line))
+        return entries
+
+    # Путь, по которому файл архива извлекается в каталог. Абсолютные имена и выход за пределы каталога запрещены
+    @staticmethod
+    def _entry_path(directory: str, name: str) -> str:
+        parts = name.split('/')
+        if not name or name.startswith('/') or '..' in parts or os.path.splitdrive(name)[0]:
+            raise InvalidStreamException(f"unsafe entry name {name}")
+        return os.path.join(directory, *parts)
+
+    # Архивация файлов entries (пар из collect) с параметрами кодирования Arico. Возвращает оглавление
+    # Файлы кодируются параллельно, а записываются в исходном порядке; одновременно в памяти не больше 2 * workers файлов
+    def create(self, entries, width=32, count_scale=0, chunk_size=65536, model='static', order=3,
+               memory_limit=64 * 1024 ** 2, engine='arithmetic', lanes=2) -> list:
+        params = Arico(None, None, width, count_scale, chunk_size, model=model, order=order, memory_limit=memory_limit,
+                       engine=engine, lanes=lanes, dictionary=self._dictionary)._block_params()
+
+        header = bytes([
+            0x41, 0x52, 0x4d,  # ARM
+            FORMAT_VERSION,
+            0x2e,  # header_checkpoint
+        ])
+        self._file.write(header)
+        offset = len(header)
+
+        toc = list()
+        models = {identifier: name for name, identifier in MODELS.items()}
+
+        def write_entry(name, future):
+            nonlocal offset
+            data, size = future.result()
+            self._file.write(data)
+            # Модель берётся из заголовка потока: несжимаемый файл записывается без кодирования
+            toc.append({'name': name, 'offset': offset, 'size': size, 'packed_size': len(data), 'model': models[data[5]]})
+            offset += len(data)
+
+        with self._executor() as executor:
+            pending = collections.deque()
+            for name, path in entries:
+                pending.append((name, executor.submit(_encode_entry, path, params)))
+                if len(pending) >= 2 * self._workers:
+                    write_entry(*pending.popleft())
+            while pending:
+                write_entry(*pending.popleft())
+
+        self._write_toc(toc, offset)
+        self._entries = toc
+        return toc
+
+    def _write_toc(self, toc: list, toc_offset: int) -> None:
+        packed = [*Arico._pack_int(len(toc))]
+        for entry in toc:
+            name = entry['name'].encode('utf8')
+            packed += [*Arico._pack_int(len(name)), *name]
+            packed += [*Arico._pack_int(entry['offset']), *Arico._pack_int(entry['size'])]
+            packed += [*Arico._pack_int(entry['packed_size']), MODELS[entry['model']]]
+
+        self._file.write(bytes(packed))
+        self._file.write(toc_offset.to_bytes(8, "big") + b"ARMT")
+
+    # Оглавление архива: словари с именем, смещением потока, исходным и сжатым размером и моделью файла
+    def entries(self) -> list:
+        if self._entries is not None:
+            return self._entries
+
+        if not Arico._is_seekable(self._file):
+            raise InvalidStreamException("multi-file archive must be seekable")
+
+        self._file.seek(0)
+        header = self._file.read(5)
+        if header[:3] != b"ARM":
+            raise InvalidSignatureException()
+        if header[3] not in SUPPORTED_VERSIONS:
+            raise UnsupportedVersionException(header[3])
+        if header[4] != 0x2e:
+            raise InvalidHeaderCheckpointByteException(header[4])
+
+        self._file.seek(-12, os.SEEK_END)
+        footer = self._file.read(12)
+        if footer[8:] != b"ARMT":
+            raise InvalidStreamException("table of contents is not found")
+        self._file.seek(int.from_bytes(footer[:8], "big"))
+
+        models = {identifier: name for name, identifier in MODELS.items()}
+        toc = list()
+        for _ in range(Arico._read_int(self._file)):
+            name = self._file.read(Arico._read_int(self._file)).decode('utf8')
+            offset, size, packed_size = (Arico._read_int(self._file) for _ in range(3))
+            model = Arico._next_byte(self._file)
+            if model not in models:
+                raise UnsupportedModelException(model)
+            toc.append({'name': name, 'offset': offset, 'size': size, 'packed_size': packed_size, 'model': models[model]})
+
+        self._entries = toc
+        return toc
+
+    def _read_entry(self, entry: dict) -> bytes:
+        self._file.seek(entry['offset'])
+        return self._file.read(entry['packed_size'])
+
+    @staticmethod
+    def _check_entry(entry: dict, result) -> bytes:
+        data, ok, _ = result
+        if not ok or len(data) != entry['size']:
+            raise InvalidStreamException(f"entry {entry['name']} failed to decode")
+        return data
+
+    # Извлечение одного файла в поток out
+    def extract(self, name: str, out) -> None:
+        for entry in self.entries():
+            if entry['name'] == name:
+                out.write(self._check_entry(entry, _decode_block(self._read_entry(entry), False, self._dictionary)))
+                return
+        raise EntryNotFoundException(name)
+
+    # Параллельное декодирование всех файлов архива. Возвращает пары (файл оглавления, данные) в порядке оглавления
+    # Контрольная сумма каждого файла сверяется при его декодировании
+    def _decode_entries(self, toc: list):
+        with self._executor() as executor:
+            pending = collections.deque()
+            for entry in toc:
+                pending.append((entry, executor.submit(_decode_block, self._read_entry(entry), False, self._dictionary)))
+                if len(pending) >= 2 * self._workers:
+                    entry, future = pending.popleft()
+                    yield entry, self._check_entry(entry, future.result())
+            while pending:
+                entry, future = pending.popleft()
+                yield entry, self._check_entry(entry, future.result())
+
+    # Параллельное извлечение всех файлов в каталог directory. Возвращает оглавление
+    def extract_all(self, directory: str) -> list:
+        toc = self.entries()
+        for entry in toc:
+            self._entry_path(directory, entry['name'])  # Небезопасное имя отвергается до начала декодирования
+
+        for entry, data in self._decode_entries(toc):
+            path = self._entry_path(directory, entry['name'])
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+
+        return toc
+
+    # Проверка всех файлов архива декодированием без записи на диск. Возвращает оглавление
+    def test(self) -> list:
+        toc = self.entries()
+        for _ in self._decode_entries(toc):
+            pass
+        return toc
+
+
+# Асинхронный источник данных: asyncio.StreamReader (или любой объект с сопрограммой read) либо асинхронный итератор байт
+async def _iterate_chunks(source, chunk_size: int):
+    if hasattr(source, "read"):
+        while chunk := await source.read(chunk_size):
+            yield chunk
+    else:
+        async for chunk in source:
+            yield chunk
+
+
+# Запись в asyncio.StreamWriter с ожиданием освобождения его буфера: пока получатель не заберёт данные,
+# следующая порция входа не читается
+async def _write_drained(writer, data: bytes) -> None:
+    if not data:
+        return
+    writer.write(data)
+    drain = getattr(writer, "drain", None)
+    if drain is not None:
+        await drain()
+
+
+# Асинхронное кодирование в блочный контейнер. Блоки кодируются в executor (по умолчанию - пул потоков цикла событий,
+# подойдёт и ProcessPoolExecutor), поэтому цикл событий не блокируется, а в памяти находится не больше одного блока
+# Параметры кодирования - те же, что у AricoCompressor. Возвращает количество записанных байт
+async def encode_async(source, writer, executor=None, chunk_size: int = 65536, **params) -> int:
+    loop = asyncio.get_running_loop()
+    compressor = AricoCompressor(chunk_size=chunk_size, **params)
+
+    header = compressor._header()
+    await _write_drained(writer, header)
+    written = len(header)
+
+    async def write_blocks(blocks):
+        nonlocal written
+        for block in blocks:
+            data, _, _ = await loop.run_in_executor(executor, _encode_block, block, compressor._params)
+            frame = compressor._pack_block(block, data)
+            await _write_drained(writer, frame)
+            written += len(frame)
+
+    async for chunk in _iterate_chunks(source, chunk_size):
+        await write_blocks(compressor._take_blocks(chunk))
+    await write_blocks(compressor._take_blocks(final=True))
+
+    await _write_drained(writer, bytes([0x00]))  # Блок нулевой длины - признак конца контейнера
+    return written + 1
+
+
+# Асинхронное декодирование блочного контейнера. Возвращает количество раскодированных байт
+async def decode_async(source, writer, executor=None, chunk_size: int = 65536, dictionary=None) -> int:
+    loop = asyncio.get_running_loop()
+    decompressor = AricoDecompressor(dictionary)
+
+    decoded = 0
+    async for chunk in _iterate_chunks(source, chunk_size):
+        for length, frame in decompressor._take_frames(chunk):
+            result = await loop.run_in_executor(executor, _decode_block, frame, False, decompressor._dictionary)
+            block = decompressor._check_block(length, result)
+            await _write_drained(writer, block)
+            decoded += len(block)
+
+    decompressor.flush()
+    return decoded
+
+
+# Открытие файла по имени. '-' обозначает стандартный поток ввода или вывода
+def open_stream(name: str, mode: str):
+    if name == '-':
+        return contextlib.nullcontext(sys.__stdin__.buffer if 'r' in mode else sys.__stdout__.buffer)
+    return open(name, mode)
+
+
+# Ширина кодового слова из командной строки: число или 'auto'
+def width_type(value: str):
+    if value == 'auto':
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid width {value!r}, expected a number or 'auto'")
+
+
+# Вывод собранной статистики в JSON: в файл или, если указан '-', в поток сообщений
+def write_stats(stats: AricoStats, name: str) -> None:
+    if name == '-':
+        print(stats.to_json())
         return
+    with open(name, 'w', encoding='utf8') as f:
+        f.write(stats.to_json() + '\n')
 
 
 if __name__ == '__main__':  # noqa: C901
@@ -487,20 +3044,48 @@ if __name__ == '__main__':  # noqa: C901
 
     parser.add_argument('-a', '--archive', action='store_true')
     parser.add_argument('-e', '--extract', action='store_true')
-    parser.add_argument('-i', '--in', required=True)
-    parser.add_argument('-o', '--out')
-    parser.add_argument('-w', '--width', type=int, default=32)
+    parser.add_argument('-t', '--test', action='store_true', help='decode the archive without writing output and verify checksums')
+    parser.add_argument('-i', '--in', required=True, help="input file, '-' for stdin")
+    parser.add_argument('-o', '--out', help="output file, '-' for stdout")
+    parser.add_argument('-w', '--width', type=width_type, default=32,
+                        help="code word width, bits, or 'auto' to pick the smallest exact width for the input")
     parser.add_argument('-s', '--scale', type=int, default=0)
     parser.add_argument('-c', '--chunk_size', type=int, default=65536)
+    parser.add_argument('-m', '--model', choices=list(MODELS.keys()), default='static')
+    parser.add_argument('--engine', choices=list(ENGINES.keys()), default='arithmetic',
+                        help='arithmetic coder with any width, byte-wise range coder with width 32 or 64 '
+                             'or rans for the static model')
+    parser.add_argument('--lanes', type=int, default=2, help='number of interleaved rans states')
+    parser.add_argument('--order', type=int, default=3)
+    parser.add_argument('--memory', type=int, default=64, help='memory limit of the ppm model context tables, MiB')
+    parser.add_argument('-b', '--block_size', type=int, default=0, help='split input into independent blocks of this size, bytes')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes for block mode')
+    parser.add_argument('--mmap', action='store_true', help='map the input file into memory instead of reading it')
+    parser.add_argument('--legacy', action='store_true', help='write the static model in the old header format')
+    parser.add_argument('--index', action='store_true', help='append a block index for range extraction (block mode)')
+    parser.add_argument('--range', help='extract only START:LENGTH bytes of a block container')
+    parser.add_argument('--multi', action='store_true',
+                        help='multi-file archive: -i is a directory or a file listing paths, one per line')
+    parser.add_argument('--entry', help='extract only this entry of a multi-file archive')
+    parser.add_argument('--list', action='store_true', help='print the table of contents of a multi-file archive')
+    parser.add_argument('--dictionary', metavar='MODEL', help='encode or decode with a trained model file')
+    parser.add_argument('--train', metavar='MODEL',
+                        help='train a model on -i (a sample file or a directory of samples) and save it to MODEL')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='PATH',
+                        help="write phase timings and coder counters as JSON to PATH, or to the console if omitted")
 
     args = parser.parse_args()
 
+    # Если результат выводится в стандартный поток вывода, то все сообщения перенаправляются в поток ошибок
+    if getattr(args, 'out') == '-' or (getattr(args, 'in') == '-' and not getattr(args, 'out')):
+        sys.stdout = sys.stderr
+
     # Нельзя одновременно и распаковать, и запаковать
     if args.archive and args.extract:
         raise Exception("You can't specify both -a and -e")
 
     # Если длина кодового слова меньше 2 - то ошибка, так как слишком коротко
-    if args.width < 2:
+    if args.width != 'auto' and args.width < 2:
         print("Code word width is too small. Enter at least 2!")
         sys.exit(1)
 
@@ -508,11 +3093,42 @@ if __name__ == '__main__':  # noqa: C901
         print("Chunk size is too small. Enter at least 1!")
         sys.exit(2)
 
+    # Порядок контекста записывается в заголовок одним байтом, а длинные контексты лишь расходуют память
+    if args.model == 'ppm' and not 1 <= args.order <= 8:
+        print("Context order must be between 1 and 8!")
+        sys.exit(3)
+
+    if args.memory < 1:
+        print("Memory limit is too small. Enter at least 1!")
+        sys.exit(4)
+
+    if args.block_size < 0 or (args.workers is not None and args.workers < 1):
+        print("Block size must not be negative and at least 1 worker is required!")
+        sys.exit(5)
+
+    # Диапазон задаётся как START:LENGTH в байтах исходных данных
+    extract_range = None
+    if args.range:
+        try:
+            extract_range = tuple(int(part) for part in args.range.split(':'))
+        except ValueError:
+            extract_range = ()
+        if len(extract_range) != 2 or min(extract_range) < 0:
+            print("Range must be given as START:LENGTH with non-negative values!")
+            sys.exit(6)
+
+    if args.index and not args.block_size:
+        print("Warning: block index is only written in block mode and is ignored")
+
+    if args.lanes not in RANS_LANES:
+        print("Number of rans lanes must be between 1 and 4!")
+        sys.exit(7)
+
     if args.chunk_size > 4 * (1024 ** 2):
         print("Warning: chunk size greater than 4MB may cause encode/decode performance issues and RAM running out")
 
     # Большая длина кодового слова может привести к проблемам с точностью и производительностью
-    if args.width > 256:
+    if args.width != 'auto' and args.width > 256:
         print("Warning: high values of code word width may cause encode/decode accuracy and performance issues")
 
     # Ширина вшивается в заголовок сжатого файла, потому нет смысла её указывать для распаковки
@@ -528,18 +3144,120 @@ if __name__ == '__main__':  # noqa: C901
     if args.scale and args.extract:
         print("Warning: frequency scaling in extraction process is ignored")
 
+    # Обученная модель загружается один раз и используется всеми файлами и блоками
+    dictionary = None
+    if args.dictionary:
+        try:
+            dictionary = AricoDictionary.load(args.dictionary)
+        except AricoException as e:
+            print(e)
+            sys.exit(e.code)
+        except OSError as e:
+            print(e)
+            sys.exit(255)
+
+    if args.train:
+        in_file = getattr(args, 'in')
+        paths = [path for _, path in AricoArchive.collect(in_file)] if os.path.isdir(in_file) else [in_file]
+        try:
+            trained = AricoDictionary.train(paths, args.chunk_size)
+            trained.save(args.train)
+        except OSError as e:
+            print(e)
+            sys.exit(255)
+        print(f"Model {trained.id.hex()} trained on {len(paths)} file(s) has been written to {args.train}")
+        sys.exit(0)
+
+    if args.test:
+        # Декодирование в приёмник, отбрасывающий данные: проверяются длины и контрольные суммы
+        in_file = getattr(args, 'in')
+        try:
+            with open_stream(in_file, 'rb') as fin:
+                if args.multi:
+                    toc = AricoArchive(fin, args.workers, dictionary).test()
+                    print(f"Tested {len(toc)} file(s) of {in_file}")
+                else:
+                    arico = Arico(fin, NullWriter(), args.width, args.scale, args.chunk_size, workers=args.workers,
+                                  use_mmap=args.mmap, stats=AricoStats() if args.stats else None, dictionary=dictionary)
+                    if not arico.decode():
+                        raise InvalidStreamException("decoded data does not match the header")
+                    if args.stats:
+                        write_stats(arico.stats, args.stats)
+            print(f"{in_file} is OK")
+            sys.exit(0)
+        except AricoException as e:
+            print(e)
+            sys.exit(e.code)
+        except Exception as e:
+            print(e)
+            sys.exit(255)
+
+    if args.archive and args.multi:
+        # Все файлы каталога или списка кодируются пулом процессов в один архив
+        in_file = getattr(args, 'in')
+        out_file = getattr(args, 'out') or in_file.rstrip('/\\') + '.arm'
+
+        try:
+            entries = AricoArchive.collect(in_file)
+            with open(out_file, 'wb') as fout:
+                toc = AricoArchive(fout, args.workers, dictionary).create(
+                    entries, args.width, args.scale, args.chunk_size, model=args.model, order=args.order,
+                    memory_limit=args.memory * 1024 ** 2, engine=args.engine, lanes=args.lanes)
+            print(f"Archived {len(toc)} file(s) into {out_file}")
+            sys.exit(0)
+        except AricoException as e:
+            print(e)
+            sys.exit(e.code)
+        except Exception as e:
+            print(e)
+            sys.exit(255)
+
+    if args.extract and args.multi:
+        # Оглавление, один файл или параллельное извлечение всего архива в каталог
+        in_file = getattr(args, 'in')
+        out_file = getattr(args, 'out')
+
+        try:
+            with open(in_file, 'rb') as fin:
+                archive = AricoArchive(fin, args.workers, dictionary)
+                if args.list:
+                    for entry in archive.entries():
+                        print(f"{entry['size']:>12} {entry['packed_size']:>12} {entry['model']:<8} {entry['name']}")
+                elif args.entry:
+                    out_file = out_file or os.path.basename(args.entry)
+                    with open_stream(out_file, 'wb') as fout:
+                        archive.extract(args.entry, fout)
+                    print(f"Extracted {args.entry} has been written to {out_file}")
+                else:
+                    out_file = out_file or '.'
+                    toc = archive.extract_all(out_file)
+                    print(f"Extracted {len(toc)} file(s) into {out_file}")
+            sys.exit(0)
+        except AricoException as e:
+            print(e)
+            sys.exit(e.code)
+        except Exception as e:
+            print(e)
+            sys.exit(255)
+
     if args.archive:
         # Открытие файла и кодирование
         in_file = getattr(args, 'in')
         out_file = getattr(args, 'out')
         if not out_file:
-            out_file = in_file + '.ari2'
-
-        with open(in_file, 'rb') as fin, open(out_file, 'wb+') as fout:
-            arico = Arico(fin, fout, args.width, args.scale)
+            out_file = in_file + '.ari2' if in_file != '-' else '-'
+
+        with open_stream(in_file, 'rb') as fin, open_stream(out_file, 'wb+') as fout:
+            arico = Arico(fin, fout, args.width, args.scale, args.chunk_size, model=args.model,
+                          order=args.order, memory_limit=args.memory * 1024 ** 2,
+                          block_size=args.block_size, workers=args.workers, index=args.index,
+                          engine=args.engine, lanes=args.lanes, legacy=args.legacy, use_mmap=args.mmap,
+                          stats=AricoStats() if args.stats else None, dictionary=dictionary)
             try:
                 arico.encode()
                 print(f"Archived data has been written to {out_file}")
+                if args.stats:
+                    write_stats(arico.stats, args.stats)
                 sys.exit(0)
             except AricoException as e:
                 print(e)
@@ -557,11 +3275,17 @@ if __name__ == '__main__':  # noqa: C901
         if not out_file:
             out_file = in_file[-4:]
 
-        with open(in_file, 'rb') as fin, open(out_file, 'wb+') as f:
-            arico = Arico(fin, f, args.width, args.scale)
+        with open_stream(in_file, 'rb') as fin, open_stream(out_file, 'wb+') as f:
+            arico = Arico(fin, f, args.width, args.scale, args.chunk_size, workers=args.workers, use_mmap=args.mmap,
+                          stats=AricoStats() if args.stats else None, dictionary=dictionary)
             try:
-                arico.decode()
+                if extract_range:
+                    arico.decode_range(*extract_range)
+                else:
+                    arico.decode()
                 print(f"Extracted data has been written to {out_file}")
+                if args.stats:
+                    write_stats(arico.stats, args.stats)
                 sys.exit(0)
             except AricoException as e:
                 print(e)
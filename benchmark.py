@@ -1,67 +1,283 @@
+import argparse
+import concurrent.futures
 import csv
+import io
+import json
+import math
+import multiprocessing
 import os
+import statistics
+import tempfile
 import time
+import tracemalloc
+
+from arico import Arico, NullWriter, width_type
+from generate_corpus import corpus_source_data
+
+# resource есть только в unix-системах, без него пиковый RSS не измеряется
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+
+# значение перцентиля по методу ближайшего ранга
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(q / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+# пиковый размер резидентной памяти процесса, КиБ (в linux ru_maxrss измеряется в КиБ, в macos - в байтах)
+def peak_rss_kib():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if os.uname().sysname == 'Darwin' else peak
+
+
+# пиковый RSS процесса, который один раз кодирует и декодирует файл, КиБ. Выполняется в отдельном процессе:
+# ru_maxrss не убывает, поэтому в общем процессе каждый случай получал бы пик самого большого из предыдущих
+# файл читается с диска, архив пишется во временный файл, а результат отбрасывается, поэтому копии данных
+# в памяти бенчмарка в замер не попадают, попадает только сам интерпретатор с кодером
+def isolated_peak_rss(input_file: str, engine: str, width):
+    with tempfile.TemporaryFile() as archive:
+        with open(input_file, 'rb') as f:
+            Arico(f, archive, width, engine=engine, verbose=False).encode()
+        archive.seek(0)
+        Arico(archive, NullWriter(), verbose=False).decode()
+    return peak_rss_kib()
+
+
+# запуск isolated_peak_rss в новом процессе. spawn вместо fork: дочерний процесс не наследует память бенчмарка
+def measure_peak_rss(input_file: str, engine: str, width):
+    if resource is None:
+        return None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(isolated_peak_rss, input_file, engine, width).result()
+
+
+# каталог именованных базовых замеров, с которыми сравниваются последующие запуски
+BASELINE_DIR = 'benchmark_baselines'
+
+
+def baseline_file_name(name: str, baseline_dir: str = BASELINE_DIR) -> str:
+    return os.path.join(baseline_dir, f'{name}.json')
+
+
+# сохранение результатов запуска как базового замера с именем name
+def save_baseline(results: list, name: str, baseline_dir: str = BASELINE_DIR) -> str:
+    os.makedirs(baseline_dir, exist_ok=True)
+    file_name = baseline_file_name(name, baseline_dir)
+    with open(file_name, 'w+', encoding='utf8') as f:
+        json.dump({'name': name, 'created': time.time(), 'results': results}, f, ensure_ascii=False, indent=2)
+    return file_name
+
+
+def load_baseline(name: str, baseline_dir: str = BASELINE_DIR) -> list:
+    with open(baseline_file_name(name, baseline_dir), encoding='utf8') as f:
+        return json.load(f)['results']
+
+
+# ключ случая: один файл, один кодер, одна ширина
+def case_key(result: dict) -> tuple:
+    return result['file_name'], result['engine'], result['width']
+
+
+# замедление по времени повторов: выборки повторов должны быть разделены с запасом tolerance, то есть
+# даже самый быстрый повтор - оказаться медленнее самого медленного повтора базового замера больше чем на tolerance.
+# Иначе рост списывается на шум. Возвращает рост медианы. Замеры короче min_time слишком шумные и не проверяются
+def time_regression(baseline_times: list, times: list, tolerance: float, min_time: float = 0.0):
+    baseline_median = statistics.median(baseline_times)
+    if not baseline_median or baseline_median < min_time:
+        return None
+    if min(times) > max(baseline_times) * (1.0 + tolerance):
+        return statistics.median(times) / baseline_median - 1.0
+    return None
+
+
+# сравнение результатов с базовым замером. Возвращает список регрессий: (ключ случая, метрика, было, стало)
+# размер архива детерминирован, поэтому для него допуск свой и по умолчанию нулевой
+def compare_results(baseline: list, results: list, tolerance: float = 0.1, size_tolerance: float = 0.0,
+                    memory_tolerance: float = 0.1, min_time: float = 0.1) -> list:
+    baseline_cases = {case_key(result): result for result in baseline}
+    regressions = list()
+
+    for result in results:
+        key = case_key(result)
+        before = baseline_cases.get(key)
+        if before is None:
+            print(f"benchmark: {key} is not in the baseline, skipped")
+            continue
+
+        for metric in ('encode', 'decode'):
+            change = time_regression(before[f'{metric}_times'], result[f'{metric}_times'], tolerance, min_time)
+            if change is not None:
+                regressions.append((key, f'{metric}_mb_s', before[f'{metric}_mb_s'], result[f'{metric}_mb_s']))
+
+        if result['size_after'] > before['size_after'] * (1.0 + size_tolerance):
+            regressions.append((key, 'size_after', before['size_after'], result['size_after']))
+
+        if result['tracemalloc_peak'] > before['tracemalloc_peak'] * (1.0 + memory_tolerance):
+            regressions.append((key, 'tracemalloc_peak', before['tracemalloc_peak'], result['tracemalloc_peak']))
+
+    for key, metric, before, after in regressions:
+        print(f"benchmark: REGRESSION {key}: {metric} {before} -> {after}")
+    print(f"benchmark: {len(regressions)} regression(s) against the baseline")
+    return regressions
 
 
 # Класс для проведения бенчмарка
+# кодирование и декодирование выполняются в текущем процессе, поэтому запуск интерпретатора не попадает в замеры
 class AricoBenchmark:
-    def __init__(self, report_file_name: str, benchmark_source_data: dict):
+    def __init__(self, report_file_name: str, benchmark_source_data: dict, engines=('arithmetic',), widths=None,
+                 repeats: int = 5, json_file_name: str = None):
         self.report_file_name = report_file_name  # название файла отчёта
+        self.json_file_name = json_file_name  # название файла отчёта в формате json, None - не записывать
         self.source_data = benchmark_source_data  # данные для бенчмарка
+        self.engines = engines  # сравниваемые кодеры, каждый файл сжимается каждым из них
+        self.widths = widths  # ширины кодового слова; None - ширина, указанная для файла в данных бенчмарка
+        self.repeats = repeats  # количество повторов каждого замера
         self.header = [  # данные заголовка таблицы результатов
             'generalized_type',
             'file_kind',
             'file_name',
+            'engine',
+            'width',
             'size_before',
             'size_after',
             'compression_coefficient',
-            'execution_time',
+            'encode_mb_s',
+            'decode_mb_s',
+            'encode_median',
+            'encode_p95',
+            'decode_median',
+            'decode_p95',
+            'tracemalloc_peak',
+            'peak_rss_kib',
+            'round_trip',
         ]
+        self.results = list()
+
+    # ширины кодового слова, с которыми файл сжимается заданным кодером
+    def case_widths(self, data: dict, engine: str) -> list:
+        widths = self.widths or [data['width']]
+        # интервальный кодер работает только с машинным словом, поэтому широкие кодовые слова заменяются на 64 бита
+        # ширину 'auto' кодер выбирает сам
+        if engine == 'range':
+            widths = sorted({width if width in (32, 64, 'auto') else 64 for width in widths}, key=str)
+        return widths
+
+    # один проход кодирования и декодирования в памяти: время кодирования, время декодирования, архив, результат
+    @staticmethod
+    def round_trip(source: bytes, engine: str, width: int):
+        archive = io.BytesIO()
+        start = time.perf_counter()
+        Arico(io.BytesIO(source), archive, width, engine=engine, verbose=False).encode()
+        encode_time = time.perf_counter() - start
+
+        restored = io.BytesIO()
+        start = time.perf_counter()
+        Arico(io.BytesIO(archive.getvalue()), restored, verbose=False).decode()
+        decode_time = time.perf_counter() - start
+
+        return encode_time, decode_time, archive.getvalue(), restored.getvalue()
+
+    # замеры одного файла одним кодером и одной шириной
+    def run_case(self, generalized_type: str, data: dict, engine: str, width: int) -> dict:
+        input_file = data['file_name']
+        print(f"benchmark: Processing file {data['kind']} ({input_file}), engine {engine}, width {width}")
+
+        with open(input_file, 'rb') as f:
+            source = f.read()
+
+        encode_times, decode_times = list(), list()
+        round_trip_ok = True
+        archive = b''
+        for _ in range(self.repeats):
+            encode_time, decode_time, archive, restored = self.round_trip(source, engine, width)
+            encode_times.append(encode_time)
+            decode_times.append(decode_time)
+            round_trip_ok = round_trip_ok and restored == source
+
+        # пиковая память измеряется отдельным проходом: tracemalloc заметно замедляет работу и исказил бы время
+        tracemalloc.start()
+        self.round_trip(source, engine, width)
+        tracemalloc_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        size_before = len(source)
+        size_after = len(archive)
+        megabytes = size_before / 1024 ** 2
+        encode_median = statistics.median(encode_times)
+        decode_median = statistics.median(decode_times)
+
+        result = {
+            'generalized_type': generalized_type,
+            'file_kind': data['kind'],
+            'file_name': input_file,
+            'engine': engine,
+            'width': width,
+            'size_before': size_before,
+            'size_after': size_after,
+            'compression_coefficient': (size_before - size_after) / size_before * 100.0 if size_before else 0.0,
+            'encode_mb_s': megabytes / encode_median if encode_median else 0.0,
+            'decode_mb_s': megabytes / decode_median if decode_median else 0.0,
+            'encode_median': encode_median,
+            'encode_p95': percentile(encode_times, 95),
+            'decode_median': decode_median,
+            'decode_p95': percentile(decode_times, 95),
+            'tracemalloc_peak': tracemalloc_peak,
+            'peak_rss_kib': measure_peak_rss(input_file, engine, width),
+            'round_trip': round_trip_ok,
+            # времена всех повторов нужны для сравнения с базовым замером, в таблицу они не попадают
+            'encode_times': encode_times,
+            'decode_times': decode_times,
+        }
 
-    def run(self):
+        print(f"benchmark: Results for {data['kind']} ({engine}, {width}): size_before = {size_before}, size_after = {size_after}, "
+              f"encode = {result['encode_mb_s']:.3f} MB/s, decode = {result['decode_mb_s']:.3f} MB/s, "
+              f"round_trip = {'OK' if round_trip_ok else 'FAIL'}")
+        return result
+
+    def run(self) -> list:
         benchmark_start = time.time()
         print(f"benchmark: Arico Benchmark Started. time = {benchmark_start}")
+        self.results = list()
+
         # открытие файла отчёта
         with open(self.report_file_name, "w+", newline='', encoding='utf8') as report_file:
-            csv_writer = csv.writer(report_file)
-            csv_writer.writerow(self.header)
+            csv_writer = csv.DictWriter(report_file, fieldnames=self.header, extrasaction='ignore')
+            csv_writer.writeheader()
 
             # для всех файлов
             for generalized_type in self.source_data.keys():
                 print(f"[ ===== Processing files of type {generalized_type} ===== ]")
                 for data in self.source_data[generalized_type]:
-                    print(f"benchmark: Processing file {data['kind']} ({data['file_name']})")
-                    start = time.time()
-
-                    input_file = data['file_name']
-                    output_file = input_file + '.ari'
-
-                    # вызов кодера в дочернем процессе
-                    os.system(f"python arico.py -a -i \"{input_file}\" -o \"{output_file}\" -w {data['width']}")
-                    delta = time.time() - start
-
-                    # вычисление коэффициента сжатия
-                    size_before = os.path.getsize(input_file)
-                    size_after = os.path.getsize(output_file)
-
-                    compression_coefficient = (size_before - size_after) / size_before * 100.0
+                    # часть данных бенчмарка - частные файлы, которых может не быть
+                    if not os.path.isfile(data['file_name']):
+                        print(f"benchmark: File {data['file_name']} is not found, skipped")
+                        continue
 
-                    print(f"benchmark: Results for {data['kind']}: size_before = {size_before}, size_after = {size_after}, compression_coefficient = {compression_coefficient}, exec_time = {delta}")
+                    for engine in self.engines:
+                        for width in self.case_widths(data, engine):
+                            result = self.run_case(generalized_type, data, engine, width)
+                            csv_writer.writerow(result)
+                            self.results.append(result)
 
-                    # запись в отчёт
-                    csv_writer.writerow([
-                        generalized_type,
-                        data['kind'],
-                        input_file,
-                        size_before,
-                        size_after,
-                        compression_coefficient,
-                        delta
-                    ])
+        if self.json_file_name:
+            with open(self.json_file_name, "w+", encoding='utf8') as json_file:
+                json.dump(self.results, json_file, ensure_ascii=False, indent=2)
+            print(f"benchmark: JSON report is written to {self.json_file_name}")
 
         print(f"benchmark: Report is written to {self.report_file_name}")
         print(f"benchmark: Finished for {time.time() - benchmark_start}")
 
+        failed = [result for result in self.results if not result['round_trip']]
+        if failed:
+            print(f"benchmark: Round trip FAILED for {len(failed)} case(s)")
+        return self.results
+
 
 if __name__ == '__main__':
     # описание данных для бенчмарка
@@ -338,5 +554,37 @@ if __name__ == '__main__':
         ],
     }
 
+    # синтетические данные, которые воспроизводятся на любой машине командой python generate_corpus.py
+    benchmark_source_data.update(corpus_source_data())
+
+    parser = argparse.ArgumentParser(prog='benchmark', description='Arico in-process benchmark')
+    parser.add_argument('--engines', nargs='+', default=['arithmetic'], help='engines to compare')
+    parser.add_argument('--widths', nargs='+', type=width_type, default=None,
+                        help="code word widths or 'auto', default - per file")
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--report', default='benchmark_report.csv', help='CSV report file')
+    parser.add_argument('--json', default=None, help='JSON report file')
+    parser.add_argument('--save_baseline', metavar='NAME', help='save this run as a named baseline')
+    parser.add_argument('--compare', metavar='NAME', help='compare this run against a named baseline')
+    parser.add_argument('--baseline_dir', default=BASELINE_DIR)
+    parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown of the median time, fraction')
+    parser.add_argument('--size_tolerance', type=float, default=0.0, help='allowed growth of the archive size, fraction')
+    parser.add_argument('--memory_tolerance', type=float, default=0.1, help='allowed growth of the peak memory, fraction')
+    parser.add_argument('--min_time', type=float, default=0.1, help='shorter median times are not compared, seconds')
+    args = parser.parse_args()
+
+    # базовый замер читается до запуска, чтобы опечатка в имени не стоила целого прогона
+    baseline = load_baseline(args.compare, args.baseline_dir) if args.compare else None
+
     # запуск бенчмарка
-    AricoBenchmark('benchmark_report.csv', benchmark_source_data).run()
+    results = AricoBenchmark(args.report, benchmark_source_data, args.engines, args.widths, args.repeats, args.json).run()
+
+    if args.save_baseline:
+        print(f"benchmark: Baseline is written to {save_baseline(results, args.save_baseline, args.baseline_dir)}")
+
+    # 1 - ошибка проверки раскодирования, 2 - регрессия относительно базового замера
+    if not all(result['round_trip'] for result in results):
+        raise SystemExit(1)
+    if baseline is not None and compare_results(baseline, results, args.tolerance, args.size_tolerance,
+                                                args.memory_tolerance, args.min_time):
+        raise SystemExit(2)
@@ -0,0 +1,156 @@
+import argparse
+import os
+import random
+
+# детерминированный генератор данных для бенчмарка: не требует сети и сторонних пакетов,
+# одинаковое зерно даёт одинаковые файлы на любой машине
+
+DATA_DIR = 'benchmark_data'
+
+# лестница размеров текста lorem ipsum в абзацах, как в benchmark.py
+LOREM_SIZES = [1, 10, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000]
+
+# лестница размеров синтетических файлов в байтах: от 1 КиБ до 64 МиБ
+SYNTHETIC_SIZES = [1 << 10, 1 << 14, 1 << 17, 1 << 20, 1 << 23, 1 << 26]
+
+LOREM_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore et dolore '
+    'magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip ex ea commodo '
+    'consequat duis aute irure in reprehenderit voluptate velit esse cillum eu fugiat nulla pariatur excepteur sint '
+    'occaecat cupidatat non proident sunt culpa qui officia deserunt mollit anim id est laborum'
+).split()
+
+
+# генератор случайных чисел отдельного файла: зависит только от зерна, вида данных и размера
+def file_random(seed: int, kind: str, size: int) -> random.Random:
+    return random.Random(f'{seed}:{kind}:{size}')
+
+
+def size_label(size: int) -> str:
+    if size >= 1 << 20:
+        return f'{size >> 20}MiB'
+    return f'{size >> 10}KiB'
+
+
+# абзац из 10 предложений, как у lorem_text
+def lorem_paragraph(rng: random.Random) -> str:
+    sentences = list()
+    for _ in range(10):
+        words = rng.choices(LOREM_WORDS, k=rng.randint(4, 12))
+        sentences.append(' '.join(words).capitalize() + '.')
+    return ' '.join(sentences) + '\n'
+
+
+def generate_lorem_ipsum(seed: int = 0, sizes=LOREM_SIZES, data_dir: str = DATA_DIR):
+    directory = os.path.join(data_dir, 'text_lorem_ipsum')
+    os.makedirs(directory, exist_ok=True)
+
+    for size in sizes:
+        rng = file_random(seed, 'lorem', size)
+        with open(os.path.join(directory, f'lorem_ipsum_{size}p.txt'), 'w+', encoding='utf8') as f:
+            for _ in range(size):
+                f.write(lorem_paragraph(rng))
+        print(f"generated lorem ipsum for {size}")
+
+
+# длинные серии одного байта: почти нулевая энтропия
+def constant_runs(rng: random.Random, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        data += bytes([rng.choice(b'\x00\x20\xff')]) * int(rng.expovariate(1 / 4096) + 1)
+    return bytes(data[:size])
+
+
+# распределение Ципфа по 256 значениям в случайном порядке: перекос, похожий на текст
+def skewed_text(rng: random.Random, size: int) -> bytes:
+    symbols = list(range(256))
+    rng.shuffle(symbols)
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(256)]
+    return bytes(rng.choices(symbols, weights, k=size))
+
+
+# несжатое 24-битное изображение BMP: градиенты с прямоугольниками и небольшим шумом
+def bitmap(rng: random.Random, size: int) -> bytes:
+    width = 256
+    row_size = width * 3
+    height = max(1, (size - 54) // row_size)
+    file_size = max(size, 54 + row_size * height)
+
+    header = bytearray(b'BM')
+    header += file_size.to_bytes(4, 'little') + bytes(4) + (54).to_bytes(4, 'little')
+    header += (40).to_bytes(4, 'little') + width.to_bytes(4, 'little') + height.to_bytes(4, 'little')
+    header += (1).to_bytes(2, 'little') + (24).to_bytes(2, 'little') + bytes(24)
+
+    rectangles = [
+        (rng.randrange(width), rng.randrange(height), rng.randrange(8, 96), rng.randrange(8, 96), bytes(rng.randbytes(3)))
+        for _ in range(max(1, height // 32))
+    ]
+
+    pixels = bytearray()
+    for y in range(height):
+        row = bytearray()
+        for x in range(width):
+            noise = rng.randrange(4)
+            row += bytes(((x + noise) & 0xff, (y + noise) & 0xff, ((x + y) // 2) & 0xff))
+        for left, top, w, h, color in rectangles:
+            if top <= y < top + h:
+                right = min(width, left + w)
+                row[left * 3:right * 3] = color * (right - left)
+        pixels += row
+
+    # остаток до заданного размера дописывается после изображения: программы просмотра его не читают
+    return bytes(header + pixels) + bytes(file_size - len(header) - len(pixels))
+
+
+def uniform_random(rng: random.Random, size: int) -> bytes:
+    return rng.randbytes(size)
+
+
+# виды синтетических данных: название набора, префикс файла и генератор
+SYNTHETIC_KINDS = {
+    'synthetic_runs': ('runs', 'bin', constant_runs),
+    'synthetic_skewed': ('skewed', 'bin', skewed_text),
+    'synthetic_bitmap': ('bitmap', 'bmp', bitmap),
+    'synthetic_random': ('random', 'bin', uniform_random),
+}
+
+
+def synthetic_file_name(generalized_type: str, size: int, data_dir: str = DATA_DIR) -> str:
+    prefix, extension, _ = SYNTHETIC_KINDS[generalized_type]
+    return os.path.join(data_dir, generalized_type, f'{prefix}_{size_label(size)}.{extension}')
+
+
+def generate_synthetic(seed: int = 0, sizes=SYNTHETIC_SIZES, data_dir: str = DATA_DIR):
+    for generalized_type, (prefix, _, generator) in SYNTHETIC_KINDS.items():
+        os.makedirs(os.path.join(data_dir, generalized_type), exist_ok=True)
+        for size in sizes:
+            with open(synthetic_file_name(generalized_type, size, data_dir), 'wb') as f:
+                f.write(generator(file_random(seed, prefix, size), size))
+            print(f"generated {prefix} for {size_label(size)}")
+
+
+# описание синтетических данных в формате данных бенчмарка
+def corpus_source_data(sizes=SYNTHETIC_SIZES, data_dir: str = DATA_DIR) -> dict:
+    return {
+        generalized_type: [
+            {
+                'kind': f'Synthetic {prefix}. {size_label(size)}',
+                'file_name': synthetic_file_name(generalized_type, size, data_dir),
+                'width': 32,
+            }
+            for size in sizes
+        ]
+        for generalized_type, (prefix, _, _) in SYNTHETIC_KINDS.items()
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='generate_corpus', description='Deterministic benchmark corpus generator')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data_dir', default=DATA_DIR)
+    parser.add_argument('--max_paragraphs', type=int, default=LOREM_SIZES[-1], help='largest lorem ipsum file, paragraphs')
+    parser.add_argument('--max_size', type=int, default=SYNTHETIC_SIZES[-1], help='largest synthetic file, bytes')
+    args = parser.parse_args()
+
+    generate_lorem_ipsum(args.seed, [size for size in LOREM_SIZES if size <= args.max_paragraphs], args.data_dir)
+    generate_synthetic(args.seed, [size for size in SYNTHETIC_SIZES if size <= args.max_size], args.data_dir)
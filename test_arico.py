@@ -0,0 +1,571 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import io
+import multiprocessing
+import os
+import pickle
+import random
+import statistics
+import tempfile
+import unittest
+from unittest import mock
+
+from arico import (DICTIONARY_VERSION, MODELS, Arico, AricoArchive, AricoCompressor, AricoDecompressor, AricoDictionary,
+                   AricoStats, ChecksumMismatchException, DictionaryNotFoundException, FenwickTree, InvalidEngineWidthException, InvalidLanesException, InvalidSignatureException,
+                   InvalidStreamException, MappedInput, UnsupportedVersionException, decode_async, encode_async)
+from benchmark import compare_results, time_regression
+
+
+def encode(data: bytes, **params) -> bytes:
+    out = io.BytesIO()
+    Arico(io.BytesIO(data), out, verbose=False, **params).encode()
+    return out.getvalue()
+
+
+def decode(data: bytes, **params) -> bytes:
+    out = io.BytesIO()
+    Arico(io.BytesIO(data), out, verbose=False, **params).decode()
+    return out.getvalue()
+
+
+def decode_range(data: bytes, start: int, length: int, **params) -> bytes:
+    out = io.BytesIO()
+    Arico(io.BytesIO(data), out, verbose=False, **params).decode_range(start, length)
+    return out.getvalue()
+
+
+# Исполнитель, выполняющий задачи сразу и считающий результаты, ещё не забранные вызывающим
+class CountingExecutor(concurrent.futures.Executor):
+
+    def __init__(self) -> None:
+        self.outstanding = 0
+        self.peak = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        executor = self
+
+        class CountedFuture(concurrent.futures.Future):
+            def result(self, timeout=None):
+                executor.outstanding -= 1
+                return super().result(timeout)
+
+        future = CountedFuture()
+        future.set_result(fn(*args, **kwargs))
+        self.outstanding += 1
+        self.peak = max(self.peak, self.outstanding)
+        return future
+
+
+SAMPLE = b"lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 200
+
+# Входы для проверки кодирования и декодирования: крайние случаи и данные с разной статистикой
+_random = random.Random(1)
+INPUTS = {
+    'empty': b"",
+    'single': b"x",
+    'repeated': b"a" * 1000,
+    'all_bytes': bytes(range(256)) * 4,
+    'text': SAMPLE,
+    'skewed': bytes(_random.choice(b"aaaaaaab") for _ in range(5000)),
+    'random': bytes(_random.randrange(256) for _ in range(5000)),
+}
+
+
+class ExceptionPicklingTest(unittest.TestCase):
+
+    def test_exception_survives_pickling(self):
+        restored = pickle.loads(pickle.dumps(InvalidSignatureException()))
+        self.assertIsInstance(restored, InvalidSignatureException)
+        self.assertEqual(restored.code, 10)
+        self.assertEqual(str(restored), str(InvalidSignatureException()))
+
+    # Ошибка блока в дочернем процессе должна дойти до вызывающего, а не разрушить пул процессов
+    def test_block_error_in_process_pool(self):
+        container = bytearray(encode(SAMPLE, block_size=1024))
+        container[container.index(b"ARI")] = 0
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                with self.assertRaises(InvalidSignatureException):
+                    decode(bytes(container), workers=workers)
+
+
+# Повреждённая контрольная сумма должна обнаруживаться при любом количестве процессов
+class ChecksumTest(unittest.TestCase):
+
+    def test_block_checksum_mismatch_in_process_pool(self):
+        container = bytearray(encode(SAMPLE, block_size=1024))
+
+        # Последний байт первого блока - младший байт его контрольной суммы
+        stream = io.BytesIO(container)
+        stream.read(4)
+        Arico._read_int(stream)
+        stream.read(1)
+        Arico._read_int(stream)
+        size = Arico._read_int(stream)
+        container[stream.tell() + size - 1] ^= 1
+
+        for workers in (1, 2):
+            with self.subTest(workers=workers):
+                with self.assertRaises(ChecksumMismatchException):
+                    decode(bytes(container), workers=workers)
+
+    def test_archive_checksum_mismatch_in_process_pool(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(SAMPLE + name.encode())
+
+            archive = io.BytesIO()
+            toc = AricoArchive(archive, workers=1).create(AricoArchive.collect(directory))
+            data = bytearray(archive.getvalue())
+            data[toc[0]['offset'] + toc[0]['packed_size'] - 1] ^= 1
+
+            for workers in (1, 2):
+                with self.subTest(workers=workers):
+                    with self.assertRaises(ChecksumMismatchException):
+                        AricoArchive(io.BytesIO(bytes(data)), workers=workers).test()
+
+
+# Извлечение диапазона из блочного контейнера с индексом и без него
+class RangeTest(unittest.TestCase):
+
+    def test_ranges(self):
+        ranges = [(0, 10), (100, 500), (1000, 100), (1023, 2), (500, 5000), (0, len(SAMPLE)), (len(SAMPLE) - 7, 100),
+                  (len(SAMPLE), 10), (5, 0)]
+        for index in (False, True):
+            container = encode(SAMPLE, block_size=1024, index=index)
+            for workers in (1, 2):
+                for start, length in ranges:
+                    with self.subTest(index=index, workers=workers, start=start, length=length):
+                        self.assertEqual(decode_range(container, start, length, workers=workers), SAMPLE[start:start + length])
+
+    # Раскодированные блоки ждут записи не дольше, чем в _decode_blocks: не больше двух на процесс
+    def test_blocks_in_flight_are_bounded(self):
+        container = encode(SAMPLE, block_size=256, index=True)
+        executor = CountingExecutor()
+        with mock.patch.object(Arico, '_executor', lambda self: executor):
+            self.assertEqual(decode_range(container, 0, len(SAMPLE), workers=2), SAMPLE)
+        self.assertLessEqual(executor.peak, 4)
+
+
+# Автоматическая ширина кодового слова - наименьшая, при которой статическая модель хранит точные частоты
+class AutoWidthTest(unittest.TestCase):
+
+    def test_smallest_width(self):
+        for length, width in ((1000, 12), (2047, 13), (2048, 13), (2049, 14), (65536, 18)):
+            data = (SAMPLE * (length // len(SAMPLE) + 1))[:length]
+            with self.subTest(length=length):
+                stream = encode(data, width='auto', legacy=False)
+                self.assertEqual(stream[8], width)
+
+                table = Arico(io.BytesIO(stream[10 + stream[9]:]), None)._read_sparse_table()
+                self.assertEqual(table, collections.Counter(data))
+                self.assertEqual(decode(stream), data)
+
+
+# Обрезанная таблица частот в заголовке должна давать ошибку формата, а не IndexError
+class SparseTableTest(unittest.TestCase):
+
+    def test_truncated_table(self):
+        stream = encode(SAMPLE, legacy=False)
+        table = 10 + stream[9]  # Таблица следует за сигнатурой, версией, моделью, кодером, шириной и длиной данных
+        end = table + 34 + stream[table + 33]  # Битовая карта, длина блока частот из одного байта и сам блок
+        for size in range(table, end):
+            with self.subTest(size=size):
+                with self.assertRaises(InvalidStreamException):
+                    decode(stream[:size])
+
+
+# Вход, отображённый в память, и освобождение отображения по окончании работы
+class MappedInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sample')
+        with open(self.path, 'wb') as f:
+            f.write(SAMPLE)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_roundtrip(self):
+        for params in (dict(), dict(legacy=False), dict(model='ppm'), dict(engine='rans'), dict(block_size=1024)):
+            with self.subTest(**params):
+                out = io.BytesIO()
+                with open(self.path, 'rb') as f:
+                    arico = Arico(f, out, verbose=False, use_mmap=True, **params)
+                    self.assertIsInstance(arico._file, MappedInput)
+                    arico.encode()
+                    self.assertTrue(arico._file._map.closed)
+
+                with open(self.path, 'wb') as f:
+                    f.write(out.getvalue())
+                with open(self.path, 'rb') as f:
+                    restored = io.BytesIO()
+                    arico = Arico(f, restored, verbose=False, use_mmap=True)
+                    arico.decode()
+                    self.assertTrue(arico._file._map.closed)
+                self.assertEqual(restored.getvalue(), SAMPLE)
+
+                with open(self.path, 'wb') as f:
+                    f.write(SAMPLE)
+
+    def test_unmappable_input_is_read_as_is(self):
+        source = io.BytesIO(SAMPLE)
+        self.assertIs(MappedInput.open(source), source)
+
+
+# Количество состояний rANS проверяется при создании кодера: 0 приводит к делению на ноль, а больше 255 не помещается в заголовок
+class LanesTest(unittest.TestCase):
+
+    def test_invalid_lanes(self):
+        for lanes in (0, 5, 256):
+            with self.subTest(lanes=lanes):
+                with self.assertRaises(InvalidLanesException):
+                    encode(SAMPLE, engine='rans', lanes=lanes)
+
+    def test_roundtrip_for_each_lanes(self):
+        for lanes in range(1, 5):
+            for name, data in INPUTS.items():
+                with self.subTest(lanes=lanes, input=name):
+                    self.assertEqual(decode(encode(data, engine='rans', lanes=lanes, legacy=False)), data)
+
+
+# Обученная модель должна передаваться исполнителям явно: процесс, запущенный через spawn, не наследует реестр моделей
+class TrainedModelTest(unittest.TestCase):
+
+    def test_archive_with_trained_model_under_spawn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(directory, name), 'wb') as f:
+                    f.write(SAMPLE + name.encode())
+            dictionary = AricoDictionary.train([os.path.join(directory, 'a.txt')])
+
+            archive = io.BytesIO()
+            AricoArchive(archive, workers=1, dictionary=dictionary).create(AricoArchive.collect(directory),
+                                                                           model='dictionary')
+
+            spawn = functools.partial(concurrent.futures.ProcessPoolExecutor, mp_context=multiprocessing.get_context('spawn'))
+            with mock.patch('concurrent.futures.ProcessPoolExecutor', spawn):
+                extracted = os.path.join(directory, 'out')
+                AricoArchive(io.BytesIO(archive.getvalue()), workers=2, dictionary=dictionary).extract_all(extracted)
+
+            for name in ('a.txt', 'b.txt'):
+                with open(os.path.join(extracted, name), 'rb') as f:
+                    self.assertEqual(f.read(), SAMPLE + name.encode())
+
+    def test_roundtrip(self):
+        dictionary = AricoDictionary({byte: SAMPLE.count(byte) + 1 for byte in range(256)})
+        for engine in ('arithmetic', 'range', 'rans'):
+            for name, data in INPUTS.items():
+                with self.subTest(engine=engine, input=name):
+                    stream = encode(data, engine=engine, legacy=False, dictionary=dictionary)
+                    self.assertEqual(decode(stream, dictionary=dictionary), data)
+
+    # Поток хранит только идентификатор модели, поэтому без модели он не раскодируется
+    def test_missing_model(self):
+        dictionary = AricoDictionary({byte: SAMPLE.count(byte) + 1 for byte in range(256)})
+        stream = encode(SAMPLE, dictionary=dictionary)
+        self.assertEqual(stream[5], MODELS['dictionary'])
+        with mock.patch.dict(AricoDictionary._registry, clear=True):
+            with self.assertRaises(DictionaryNotFoundException):
+                decode(stream)
+
+    def test_streaming_with_trained_model(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.txt')
+            with open(path, 'wb') as f:
+                f.write(SAMPLE)
+            dictionary = AricoDictionary.train([path])
+
+        compressor = AricoCompressor(block_size=4096, dictionary=dictionary)
+        container = compressor.feed(SAMPLE) + compressor.flush()
+        self.assertEqual(container, encode(SAMPLE, block_size=4096, dictionary=dictionary))
+
+        decompressor = AricoDecompressor(dictionary)
+        self.assertEqual(decompressor.feed(container) + decompressor.flush(), SAMPLE)
+
+    # Дочерний процесс, запущенный через spawn, получает модель только вместе с задачей
+    def test_async_with_trained_model_under_spawn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'a.txt')
+            with open(path, 'wb') as f:
+                f.write(SAMPLE)
+            dictionary = AricoDictionary.train([path])
+
+        async def chunks(data):
+            for position in range(0, len(data), 1000):
+                yield data[position:position + 1000]
+
+        async def round_trip(executor):
+            container, decoded = io.BytesIO(), io.BytesIO()
+            await encode_async(chunks(SAMPLE), container, executor, block_size=4096, dictionary=dictionary)
+            await decode_async(chunks(container.getvalue()), decoded, executor, dictionary=dictionary)
+            return decoded.getvalue()
+
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2, mp_context=context) as executor:
+            self.assertEqual(asyncio.run(round_trip(executor)), SAMPLE)
+
+    def test_model_file_has_its_own_version(self):
+        dictionary = AricoDictionary({byte: byte + 1 for byte in range(256)})
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'm.ard')
+            dictionary.save(path)
+            with open(path, 'rb') as f:
+                content = f.read()
+            self.assertEqual(content[:4], b"ARD" + bytes([DICTIONARY_VERSION]))
+            self.assertEqual(AricoDictionary.load(path).id, dictionary.id)
+
+            broken = os.path.join(directory, 'broken.ard')
+            with open(broken, 'wb') as f:
+                f.write(content[:3] + bytes([DICTIONARY_VERSION + 1]) + content[4:])
+            with self.assertRaises(UnsupportedVersionException):
+                AricoDictionary.load(broken)
+
+
+# Адаптивная модель: частоты в дереве Фенвика меняются после каждого символа одинаково у кодера и декодера
+class AdaptiveModelTest(unittest.TestCase):
+
+    def test_fenwick_tree_matches_prefix_sums(self):
+        generator = random.Random(2)
+        frequencies = [generator.randrange(1, 50) for _ in range(257)]
+        tree = FenwickTree(frequencies)
+        for symbol in (0, 1, 100, 255, 256):
+            tree.add(symbol, 7)
+            frequencies[symbol] += 7
+
+        for idx in range(len(frequencies) + 1):
+            self.assertEqual(tree.prefix(idx), sum(frequencies[:idx]))
+        for value in range(0, sum(frequencies), 13):
+            symbol, low = tree.find(value)
+            self.assertEqual(low, sum(frequencies[:symbol]))
+            self.assertLess(value, low + frequencies[symbol])
+
+    # Текст длиннее порога масштабирования частот, поэтому проверяется и масштабирование
+    def test_roundtrip(self):
+        for name, data in INPUTS.items():
+            with self.subTest(input=name):
+                self.assertEqual(decode(encode(data, model='adaptive')), data)
+
+
+# Контекстная модель: каждый порядок и вытеснение контекстов при нехватке памяти
+class ContextModelTest(unittest.TestCase):
+
+    def test_roundtrip_for_each_order(self):
+        for order in range(1, 9):
+            for name in ('text', 'skewed', 'random'):
+                with self.subTest(order=order, input=name):
+                    data = INPUTS[name]
+                    self.assertEqual(decode(encode(data, model='ppm', order=order)), data)
+
+    def test_edge_cases(self):
+        for name in ('empty', 'single', 'repeated', 'all_bytes'):
+            with self.subTest(input=name):
+                self.assertEqual(decode(encode(INPUTS[name], model='ppm')), INPUTS[name])
+
+    # Лимит памяти записан в заголовке, поэтому декодер вытесняет те же контексты, что и кодер
+    def test_eviction(self):
+        data = INPUTS['random'] + SAMPLE
+        stats = AricoStats()
+        stream = encode(data, model='ppm', order=4, memory_limit=64 * 1024, stats=stats)
+        self.assertGreater(stats.counters['evictions'], 0)
+        self.assertEqual(decode(stream), data)
+
+
+# Интервальный кодер на машинном слове: обе ширины со всеми моделями
+class RangeCoderTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for width in (32, 64):
+            for model in ('static', 'adaptive', 'ppm'):
+                for name, data in INPUTS.items():
+                    with self.subTest(width=width, model=model, input=name):
+                        stream = encode(data, engine='range', width=width, model=model, legacy=False)
+                        self.assertEqual(decode(stream), data)
+
+    # При ширине 32 сумма частот ограничена 2 ** 16, поэтому частоты длинного входа квантуются
+    def test_quantized_frequencies(self):
+        data = SAMPLE * 10 + INPUTS['random']
+        self.assertEqual(decode(encode(data, engine='range', width=32, legacy=False)), data)
+
+    def test_unsupported_width(self):
+        for width in (16, 48):
+            with self.subTest(width=width):
+                with self.assertRaises(InvalidEngineWidthException):
+                    encode(SAMPLE, engine='range', width=width, legacy=False)
+
+
+# Инкрементальные кодер и декодер: результат не зависит от того, как вход разбит на части
+class StreamingTest(unittest.TestCase):
+
+    @staticmethod
+    def split(data: bytes, size: int) -> list:
+        return [data[position:position + size] for position in range(0, len(data), size)]
+
+    def test_feed_boundaries(self):
+        data = SAMPLE + INPUTS['random']
+        container = encode(data, block_size=1000)
+        for size in (1, 7, 999, 1000, 1001, len(data)):
+            with self.subTest(size=size):
+                compressor = AricoCompressor(block_size=1000)
+                encoded = b"".join(compressor.feed(part) for part in self.split(data, size)) + compressor.flush()
+                self.assertEqual(encoded, container)
+
+                decompressor = AricoDecompressor()
+                decoded = b"".join(decompressor.feed(part) for part in self.split(container, size))
+                self.assertEqual(decoded + decompressor.flush(), data)
+                self.assertTrue(decompressor.eof)
+
+    def test_empty_input(self):
+        compressor = AricoCompressor()
+        container = compressor.flush()
+        self.assertEqual(decode(container), b"")
+
+        decompressor = AricoDecompressor()
+        self.assertEqual(decompressor.feed(container) + decompressor.flush(), b"")
+
+    # Данные после конца контейнера не раскодируются, а сохраняются, в том числе поданные после его конца
+    def test_unused_data(self):
+        compressor = AricoCompressor(block_size=1000)
+        container = compressor.feed(SAMPLE) + compressor.flush()
+
+        for size in (1, 100, len(container) + 3):
+            with self.subTest(size=size):
+                decompressor = AricoDecompressor()
+                decoded = b"".join(decompressor.feed(part) for part in self.split(container + b"tail", size))
+                self.assertEqual(decoded, SAMPLE)
+                self.assertEqual(decompressor.unused_data, b"tail")
+
+        decompressor.feed(b"more")
+        self.assertEqual(decompressor.unused_data, b"tailmore")
+
+    def test_truncated_container(self):
+        compressor = AricoCompressor(block_size=1000)
+        container = compressor.feed(SAMPLE) + compressor.flush()
+
+        for size in range(0, len(container), 97):
+            with self.subTest(size=size):
+                decompressor = AricoDecompressor()
+                decompressor.feed(container[:size])
+                self.assertFalse(decompressor.eof)
+                with self.assertRaises(InvalidStreamException):
+                    decompressor.flush()
+
+    def test_feed_after_flush(self):
+        compressor = AricoCompressor()
+        compressor.feed(SAMPLE)
+        self.assertTrue(compressor.flush())
+        self.assertEqual(compressor.flush(), b"")
+        with self.assertRaises(ValueError):
+            compressor.feed(SAMPLE)
+
+
+# Асинхронные кодирование и декодирование: вход - asyncio.StreamReader, выход ждёт освобождения буфера
+class AsyncTest(unittest.TestCase):
+
+    # Получатель, у которого, как у asyncio.StreamWriter, есть drain
+    class Writer(io.BytesIO):
+
+        def __init__(self) -> None:
+            super().__init__()
+            self.drains = 0
+
+        async def drain(self) -> None:
+            self.drains += 1
+
+    @staticmethod
+    def reader(data: bytes) -> asyncio.StreamReader:
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return reader
+
+    def test_roundtrip(self):
+        async def round_trip(data):
+            container, decoded = self.Writer(), self.Writer()
+            # Несжимаемые блоки хранятся кадрами по chunk_size, поэтому он тот же, что у encode
+            written = await encode_async(self.reader(data), container, chunk_size=999, block_size=1000)
+            self.assertEqual(written, len(container.getvalue()))
+            self.assertGreater(container.drains, 0)
+
+            self.assertEqual(await decode_async(self.reader(container.getvalue()), decoded, chunk_size=77), len(data))
+            return container.getvalue(), decoded.getvalue()
+
+        for name, data in INPUTS.items():
+            with self.subTest(input=name):
+                container, decoded = asyncio.run(round_trip(data))
+                self.assertEqual(container, encode(data, block_size=1000, chunk_size=999))
+                self.assertEqual(decoded, data)
+
+    def test_truncated_container(self):
+        container = encode(SAMPLE, block_size=1000)
+
+        async def truncated():
+            await decode_async(self.reader(container[:-1]), self.Writer())
+
+        with self.assertRaises(InvalidStreamException):
+            asyncio.run(truncated())
+
+
+# Несжимаемые данные записываются без кодирования, а сжимаемые по-прежнему кодируются
+class StoredTest(unittest.TestCase):
+
+    def test_incompressible_input_is_stored(self):
+        for engine in ('arithmetic', 'range', 'rans'):
+            with self.subTest(engine=engine):
+                stats = AricoStats()
+                stream = encode(INPUTS['random'], engine=engine, legacy=False, stats=stats)
+                self.assertEqual(stream[5], MODELS['stored'])
+                self.assertEqual(stats.counters['stored'], 1)
+                self.assertEqual(decode(stream), INPUTS['random'])
+
+                self.assertEqual(encode(SAMPLE, engine=engine, legacy=False)[5], MODELS['static'])
+
+    # Короткие кадры, чтобы данные занимали несколько кадров
+    def test_roundtrip(self):
+        for name, data in INPUTS.items():
+            with self.subTest(input=name):
+                self.assertEqual(decode(encode(data, model='stored', chunk_size=100)), data)
+
+    # Каждый блок контейнера выбирает хранение независимо
+    def test_mixed_blocks(self):
+        data = SAMPLE[:2000] + INPUTS['random'][:2000] + SAMPLE[:2000]
+        stats = AricoStats()
+        container = encode(data, block_size=2000, stats=stats)
+        self.assertEqual(stats.counters['stored'], 1)
+        self.assertEqual(decode(container), data)
+
+
+# Сравнение с базовым замером бенчмарка: шум повторов не должен считаться регрессией
+class BenchmarkGateTest(unittest.TestCase):
+
+    @staticmethod
+    def result(encode_times, decode_times, size_after=100, memory=1000) -> dict:
+        return {'file_name': 'a', 'engine': 'arithmetic', 'width': 32, 'size_after': size_after,
+                'tracemalloc_peak': memory, 'encode_times': encode_times, 'decode_times': decode_times,
+                'encode_mb_s': 1.0 / statistics.median(encode_times), 'decode_mb_s': 1.0 / statistics.median(decode_times)}
+
+    def test_overlapping_repeats_are_noise(self):
+        self.assertIsNone(time_regression([1.0, 1.2], [1.3, 1.15, 1.1, 1.4, 1.25], tolerance=0.1))
+        self.assertIsNone(time_regression([1.0, 1.02], [1.1, 1.15, 1.14], tolerance=0.1))
+
+    def test_separated_repeats_are_regression(self):
+        self.assertAlmostEqual(time_regression([1.0, 1.1], [1.5, 1.6, 1.55], tolerance=0.1), 1.55 / 1.05 - 1.0)
+
+    def test_short_cases_are_not_timed(self):
+        self.assertIsNone(time_regression([0.001, 0.001], [0.01, 0.01], tolerance=0.1, min_time=0.1))
+
+    def test_compare_results(self):
+        baseline = [self.result([1.0, 1.1], [1.0, 1.1])]
+        self.assertEqual(compare_results(baseline, [self.result([1.05, 1.2, 0.95], [1.1, 1.0, 1.15])]), [])
+
+        regressions = compare_results(baseline, [self.result([2.0, 2.1], [1.0, 1.1], size_after=101, memory=2000)])
+        self.assertEqual([metric for _, metric, _, _ in regressions], ['encode_mb_s', 'size_after', 'tracemalloc_peak'])
+
+
+if __name__ == '__main__':
+    unittest.main()